@@ -21,13 +21,18 @@ Usage
   python gcode_3d.py <structure.nbt> [output.gcode]
 """
 
+import gzip
+import mmap
+import os
+import struct
 import sys
+from concurrent.futures import ProcessPoolExecutor
 from pathlib import Path
 
 try:
-    import nbtlib
+    import numpy as np
 except ImportError:
-    sys.exit("Missing dependency — install it with:  pip install nbtlib")
+    sys.exit("Missing dependency — install it with:  pip install numpy")
 
 
 # ═══════════════════════════════════════════════════════════════════════════════
@@ -63,6 +68,12 @@ FEED_APPROACH      =  4000  # mm/min  slow descent into placement zone
 FEED_PUSH          =   500  # mm/min  final push onto studs
 APPROACH_CLEARANCE =   6.0  # mm   start slowing this far above placement Z
 
+# ── Output verbosity ───────────────────────────────────────────────────────────
+# Decorative per-brick banners and ;TYPE markers often outweigh the functional
+# G-code 2:1.  `--compact` on the CLI turns this off; M73 progress and
+# ;LAYER_CHANGE metadata are always kept.
+EMIT_COMMENTS = True
+
 
 # ═══════════════════════════════════════════════════════════════════════════════
 #  AIR BLOCKS  (treated as empty — no brick placed)
@@ -77,6 +88,157 @@ AIR_BLOCKS = {
 # ═══════════════════════════════════════════════════════════════════════════════
 #  PARSING
 # ═══════════════════════════════════════════════════════════════════════════════
+# Structure-block NBT is read with a minimal streaming parser instead of a
+# full NBT library: only `size`, the palette `Name` strings, and each block's
+# `pos`/`state` are decoded — every other tag payload is skipped by offset
+# arithmetic, never materialized as Python objects.
+
+# NBT tag ids (big-endian wire format)
+(_TAG_END, _TAG_BYTE, _TAG_SHORT, _TAG_INT, _TAG_LONG, _TAG_FLOAT, _TAG_DOUBLE,
+ _TAG_BYTE_ARRAY, _TAG_STRING, _TAG_LIST, _TAG_COMPOUND, _TAG_INT_ARRAY,
+ _TAG_LONG_ARRAY) = range(13)
+
+_TAG_FIXED_SIZE = {_TAG_BYTE: 1, _TAG_SHORT: 2, _TAG_INT: 4, _TAG_FLOAT: 4,
+                   _TAG_LONG: 8, _TAG_DOUBLE: 8}
+
+
+def _skip_payload(data, off: int, tag: int) -> int:
+    """Return the offset just past the payload of `tag` starting at `off`."""
+    fixed = _TAG_FIXED_SIZE.get(tag)
+    if fixed is not None:
+        return off + fixed
+    if tag == _TAG_STRING:
+        return off + 2 + int.from_bytes(data[off:off + 2], "big")
+    if tag == _TAG_BYTE_ARRAY:
+        return off + 4 + int.from_bytes(data[off:off + 4], "big", signed=True)
+    if tag == _TAG_INT_ARRAY:
+        return off + 4 + 4 * int.from_bytes(data[off:off + 4], "big", signed=True)
+    if tag == _TAG_LONG_ARRAY:
+        return off + 4 + 8 * int.from_bytes(data[off:off + 4], "big", signed=True)
+    if tag == _TAG_LIST:
+        etag = data[off]
+        n    = int.from_bytes(data[off + 1:off + 5], "big", signed=True)
+        off += 5
+        fixed = _TAG_FIXED_SIZE.get(etag)
+        if fixed is not None:
+            return off + fixed * n
+        for _ in range(n):
+            off = _skip_payload(data, off, etag)
+        return off
+    if tag == _TAG_COMPOUND:
+        while True:
+            t = data[off]
+            off += 1
+            if t == _TAG_END:
+                return off
+            off += 2 + int.from_bytes(data[off:off + 2], "big")
+            off = _skip_payload(data, off, t)
+    raise ValueError(f"unsupported NBT tag id {tag}")
+
+
+def _read_list_header(data, off: int):
+    """Read a TAG_List header → (offset past header, element tag, count)."""
+    etag = data[off]
+    n    = int.from_bytes(data[off + 1:off + 5], "big", signed=True)
+    return off + 5, etag, n
+
+
+def _read_palette(data, off: int):
+    """Read the palette list; return (new offset, list of block-name strings)."""
+    off, etag, n = _read_list_header(data, off)
+    names = [""] * n
+    for i in range(n):
+        # each entry: compound with a Name string and optional Properties
+        while True:
+            t = data[off]
+            off += 1
+            if t == _TAG_END:
+                break
+            nlen = int.from_bytes(data[off:off + 2], "big")
+            name = bytes(data[off + 2:off + 2 + nlen])
+            off += 2 + nlen
+            if t == _TAG_STRING and name == b"Name":
+                slen = int.from_bytes(data[off:off + 2], "big")
+                names[i] = str(data[off + 2:off + 2 + slen], "utf-8")
+                off += 2 + slen
+            else:
+                off = _skip_payload(data, off, t)
+    return off, names
+
+
+def _read_blocks(data, off: int):
+    """Read the blocks list; return (new offset, (N, 4) int32 array of x,y,z,state)."""
+    off, etag, n = _read_list_header(data, off)
+    arr = np.empty((n, 4), dtype=np.int32)
+    unpack_pos = struct.Struct(">3i").unpack_from
+    for i in range(n):
+        state = 0
+        pos   = (0, 0, 0)
+        while True:
+            t = data[off]
+            off += 1
+            if t == _TAG_END:
+                break
+            nlen = int.from_bytes(data[off:off + 2], "big")
+            name = bytes(data[off + 2:off + 2 + nlen])
+            off += 2 + nlen
+            if t == _TAG_LIST and name == b"pos":
+                off += 5                      # element tag (Int) + count (3)
+                pos  = unpack_pos(data, off)
+                off += 12
+            elif t == _TAG_INT and name == b"state":
+                state = int.from_bytes(data[off:off + 4], "big", signed=True)
+                off  += 4
+            else:
+                off = _skip_payload(data, off, t)
+        arr[i, 0] = pos[0]
+        arr[i, 1] = pos[1]
+        arr[i, 2] = pos[2]
+        arr[i, 3] = state
+    return off, arr
+
+
+def _read_structure(nbt_path: str):
+    """Stream-parse a structure NBT file → (size, palette_names, (N,4) blocks)."""
+    with open(nbt_path, "rb") as f:
+        # mmap the compressed file so gzip.decompress reads straight out of the
+        # page cache — no intermediate file-object buffering or double read.
+        with mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ) as raw:
+            if raw[:2] == b"\x1f\x8b":       # gzip magic — structure files default
+                data = memoryview(gzip.decompress(raw))
+            else:                            # rare: already-uncompressed NBT
+                data = memoryview(bytes(raw))
+
+    off = 0
+    if data[off] != _TAG_COMPOUND:
+        raise ValueError(f"{nbt_path}: not an NBT compound root")
+    off += 1
+    off += 2 + int.from_bytes(data[off:off + 2], "big")   # root name
+
+    size = palette_names = blocks = None
+    while True:
+        t = data[off]
+        off += 1
+        if t == _TAG_END:
+            break
+        nlen = int.from_bytes(data[off:off + 2], "big")
+        name = bytes(data[off + 2:off + 2 + nlen])
+        off += 2 + nlen
+        if t == _TAG_LIST and name == b"size":
+            off, etag, n = _read_list_header(data, off)
+            size = list(struct.unpack_from(f">{n}i", data, off))
+            off += 4 * n
+        elif t == _TAG_LIST and name == b"palette":
+            off, palette_names = _read_palette(data, off)
+        elif t == _TAG_LIST and name == b"blocks":
+            off, blocks = _read_blocks(data, off)
+        else:
+            off = _skip_payload(data, off, t)
+
+    if size is None or palette_names is None or blocks is None:
+        raise ValueError(f"{nbt_path}: missing size/palette/blocks — not a structure file?")
+    return size, palette_names, blocks
+
 
 def parse_structure(nbt_path: str):
     """
@@ -84,43 +246,79 @@ def parse_structure(nbt_path: str):
 
     Returns
     -------
-    blocks   : list of (col_x, col_y, row) tuples for every non-air block
+    blocks   : (N, 3) int32 array of (col_x, col_y, row) rows, one per non-air block
                col_x = Minecraft X, col_y = Minecraft Z, row = Minecraft Y
     size_x   : structure width  (Minecraft X)
     size_y   : structure height (Minecraft Y)
     size_z   : structure depth  (Minecraft Z)
     """
-    print(f"  Loading NBT: {nbt_path}")
-    nbt  = nbtlib.load(nbt_path)
-    root = nbt.get("", nbt)
+    # Repeated runs on the same structure skip NBT parsing entirely: the
+    # derived block array is cached next to the source, keyed by mtime+size
+    # so edits to the .nbt invalidate it.
+    st = os.stat(nbt_path)
+    stamp = np.array([st.st_mtime_ns, st.st_size], dtype=np.int64)
+    # Tool-specific suffix: nbt_to_gcode.py keeps its own sidecar with a
+    # different schema, so sharing a filename would make each run evict the
+    # other's.  Every key is read before the hit is announced — a mismatched
+    # schema must fall through to the reparse silently.
+    cache = Path(nbt_path + ".gcode_3d.cache.npz")
+    if cache.exists():
+        try:
+            with np.load(cache) as npz:
+                if np.array_equal(npz["stamp"], stamp):
+                    blocks = npz["blocks"]
+                    size_x, size_y, size_z = (int(v) for v in npz["size"])
+                    print(f"  Loading cached parse: {cache}")
+                    return blocks, size_x, size_y, size_z
+        except (OSError, KeyError, ValueError):
+            pass                             # stale or corrupt cache — reparse
 
-    size       = root["size"]
-    palette    = root["palette"]
-    raw_blocks = root["blocks"]
+    print(f"  Loading NBT: {nbt_path}")
+    size, palette_names, arr = _read_structure(nbt_path)
 
     size_x = int(size[0])   # Minecraft X → printer X
     size_y = int(size[1])   # Minecraft Y → printer Z (height)
     size_z = int(size[2])   # Minecraft Z → printer Y (depth)
 
-    blocks = []
-    seen   = set()
-
-    for blk in raw_blocks:
-        pos       = blk["pos"]
-        state_idx = int(blk["state"])
-        name      = str(palette[state_idx]["Name"])
-
-        if name in AIR_BLOCKS:
-            continue
-
-        col_x = int(pos[0])   # Minecraft X
-        row   = int(pos[1])   # Minecraft Y → height
-        col_y = int(pos[2])   # Minecraft Z → depth
-
-        key = (col_x, col_y, row)
-        if key not in seen:
-            seen.add(key)
-            blocks.append((col_x, col_y, row))
+    # Resolve which palette indices are air ONCE — the palette is tiny,
+    # the block list is not.
+    air_idx = np.array([i for i, name in enumerate(palette_names)
+                        if name in AIR_BLOCKS], dtype=np.int32)
+
+    kept = arr if len(air_idx) == 0 else arr[~np.isin(arr[:, 3], air_idx)]
+
+    # A malformed pos outside the declared size would wrap negatives through
+    # the uint64 packing below (row=-1 silently becomes a valid-looking key)
+    # and index past the preview grid — drop such blocks up front, as the
+    # other two converters do.
+    in_bounds = ((kept[:, 0] >= 0) & (kept[:, 0] < size_x)
+                 & (kept[:, 1] >= 0) & (kept[:, 1] < size_y)
+                 & (kept[:, 2] >= 0) & (kept[:, 2] < size_z))
+    if not in_bounds.all():
+        n_oob = int(in_bounds.size) - int(np.count_nonzero(in_bounds))
+        print(f"  NOTE: {n_oob} block(s) outside the declared "
+              f"{size_x}×{size_y}×{size_z} structure size — ignored.")
+        kept = kept[in_bounds]
+
+    # Structure coordinates fit in 16 bits each, so pack (col_x, col_y, row)
+    # into one uint64 key — dedup then works on a single scalar per block
+    # instead of a 3-column row compare.
+    key = (kept[:, 0].astype(np.uint64)            # col_x  (Minecraft X)
+           | (kept[:, 2].astype(np.uint64) << 16)  # col_y  (Minecraft Z)
+           | (kept[:, 1].astype(np.uint64) << 32)) # row    (Minecraft Y)
+    key = np.unique(key)
+
+    blocks = np.empty((len(key), 3), dtype=np.int32)
+    blocks[:, 0] = key & 0xFFFF           # col_x
+    blocks[:, 1] = (key >> 16) & 0xFFFF   # col_y
+    blocks[:, 2] = key >> 32              # row
+
+    try:
+        np.savez(cache, blocks=blocks,
+                 size=np.array([size_x, size_y, size_z], dtype=np.int64),
+                 stamp=stamp)
+    except OSError:
+        pass                                 # read-only location — cache is optional
 
     return blocks, size_x, size_y, size_z
 
@@ -131,13 +329,16 @@ def parse_structure(nbt_path: str):
 
 def print_preview(blocks, size_x, size_y, size_z):
     """Print a top-down slice per layer (Minecraft Y). R = brick, . = air."""
-    filled = {(cx, cy, r) for cx, cy, r in blocks}
+    # Dense uint8 occupancy grid: rendering a slice row is then a straight
+    # tobytes() copy instead of size_x set lookups per line.
+    grid = np.full((size_y, size_z, size_x), ord('.'), dtype=np.uint8)
+    grid[blocks[:, 2], blocks[:, 1], blocks[:, 0]] = ord('R')
+
     print(f"\n  Preview (one slice per height layer — X = left-right, Z = top-to-bottom):")
     for row in range(size_y):
         print(f"\n  Layer Y={row}  (printer Z = {WALL_ORIGIN_Z + row * BRICK_HEIGHT:.1f} mm):")
         for cy in range(size_z):
-            line = "".join("R" if (cx, cy, row) in filled else "." for cx in range(size_x))
-            print(f"    {line}")
+            print("    " + grid[row, cy].tobytes().decode('ascii'))
 
 
 # ═══════════════════════════════════════════════════════════════════════════════
@@ -167,22 +368,165 @@ def approach_nozzle_z(row: int) -> float:
 #  G-CODE GENERATION
 # ═══════════════════════════════════════════════════════════════════════════════
 
-def generate_gcode(blocks, size_x: int, size_y: int, size_z: int) -> str:
-    lines = []
+# Precompiled bytes templates for the two standalone move shapes (start/end
+# code); bytes %-interpolation hits CPython's C formatter directly.
+_FMT_G0_Z = b"G0 Z%.3f F%d ; %s\n"
+_FMT_G1_Z = b"G1 Z%.3f F%d ; %s\n"      # slow moves (feed < FEED_APPROACH)
+
+# The full pick/place cycle for one brick, rendered with a single bytes-%
+# per brick.  Machine constants (dispenser, feeds, dwell, safe Z) are baked
+# in at import time; only per-brick values remain as placeholders, in order:
+#   idx+1, total, col_x, col_y, row, target_x, target_y, place_z,
+#   target_x, target_y, col_x, col_y, row, appr_z, place_z
+# Coordinate slots are %s: every coordinate is one of size_x+size_z+size_y
+# distinct values, so callers pass pre-formatted byte tokens (see the token
+# tables in generate_gcode) instead of re-running the float formatter per brick.
+_BRICK_TEMPLATE = (
+    "; ── Brick %4d/%d  col_x=%d  col_y=%d  row=%d"
+    "  →  X=%s  Y=%s  Z=%s ──\n"
+    ";    [pick-up RED]\n"
+    ";TYPE:Travel\n"
+    f"G0 X{DISPENSER['x']:.3f} Y{DISPENSER['y']:.3f} F{FEED_TRAVEL:d}"
+    " ; move over RED dispenser\n"
+    f"G0 Z{DISPENSER['z']:.3f} F{FEED_APPROACH:d} ; descend to grab height\n"
+    f"G4 P{DISPENSER_DWELL}  ; dwell — let block seat in socket\n"
+    f"G0 Z{SAFE_Z:.3f} F{FEED_CARRY:d} ; rise with brick\n"
+    "\n"
+    ";    [travel to brick]\n"
+    ";TYPE:Custom\n"
+    "G1 X%s Y%s E0.0500 "
+    f"F{FEED_CARRY:d}"
+    " ; position over col_x=%d col_y=%d row=%d\n"
+    "G92 E0   ; reset E after travel mark\n"
+    "\n"
+    ";    [place]\n"
+    ";TYPE:Travel\n"
+    "G0 Z%s "
+    f"F{FEED_APPROACH:d} ; slow approach ({APPROACH_CLEARANCE:.0f} mm above target)\n"
+    "G1 Z%s "
+    f"F{FEED_PUSH:d} ; push brick onto studs\n"
+    "G4 P200  ; dwell 200 ms — ensure engagement\n"
+    ";TYPE:Travel\n"
+    f"G0 Z{SAFE_Z:.3f} F{FEED_TRAVEL:d} ; retract to travel height\n"
+    "\n"
+).encode("utf-8")
+
+_LAYER_HEIGHT_LINE = f";HEIGHT:{BRICK_HEIGHT:.3f}\n".encode("utf-8")
+
+# Compact variant: the full template minus comment-only and blank lines.
+# Derived mechanically so the two can never drift; dropping the banner line
+# also drops its placeholders, leaving the seven coordinate/column slots.
+_BRICK_TEMPLATE_COMPACT = b"".join(
+    line + b"\n" for line in _BRICK_TEMPLATE.split(b"\n")
+    if line and not line.startswith(b";")
+)
+
+# Start G-code is fully static — encode it once at import instead of
+# pushing each line through emit()'s per-string encode.
+_START_GCODE = (
+    "M73 P0 R0 Q0 S0        ; progress: 0%\n"
+    "M201 X1000 Y1000 Z200  ; max accelerations [mm/s^2]\n"
+    "M203 X200 Y200 Z12     ; max feedrates [mm/s]\n"
+    "M204 P1250 T1250       ; print / travel acceleration [mm/s^2]\n"
+    "M205 X8.00 Y8.00 Z0.40 ; jerk limits [mm/s]\n"
+    "G21                    ; units: millimetres\n"
+    "G90                    ; absolute positioning\n"
+    "G28 X Y                ; home X and Y\n"
+    "G92 X-11 Y-7           ; offset origin to working zero\n"
+    "G92 Z3.8               ; declare current Z (manually parked before run)\n"
+    "M211 S0                ; disable software endstops — allow negative Z\n"
+    "M83                    ; relative extruder mode\n"
+    "G92 E0                 ; reset extruder position\n"
+    "\n"
+).encode("utf-8")
+
+_END_GCODE = (
+    "M211 S1      ; re-enable software endstops\n"
+    "M84          ; disable steppers\n"
+).encode("utf-8")
+
+# Flush the accumulation buffer to the file once it grows past this size.
+_FLUSH_BYTES = 1 << 20
+
+# Bricks formatted per _format_band call on the serial path (bounds memory);
+# jobs at least this many bricks total are fanned out across processes.
+_BAND_BRICKS        = 4096
+_PARALLEL_MIN_BRICKS = 20000
+
+
+def _format_band(col_x_arr, col_y_arr, row_arr, x1, y1, z1, x3, y3, appr3,
+                 place3, start: int, total: int, size_y: int,
+                 prev_row: int, prev_pct: int, comments: bool = True) -> bytearray:
+    """Format bricks [start, start+len) into G-code bytes.
+
+    Pure function of its band — safe to run in a worker process.  `prev_row`
+    and `prev_pct` carry the layer/progress state from the previous band so
+    markers are not duplicated at band boundaries.  Coordinates come in as
+    pre-formatted byte tokens indexed by column/row (x1/y1/z1 are %.1f,
+    x3/y3/appr3/place3 are %.3f).
+    """
+    buf = bytearray()
+    current_row = prev_row
+    last_pct    = prev_pct
+
+    # Indexing an ndarray yields numpy scalar objects, which cost far more
+    # than plain ints under bytes-% and list indexing — convert each band to
+    # Python ints up front.
+    col_x_list = col_x_arr.tolist()
+    col_y_list = col_y_arr.tolist()
+    row_list   = row_arr.tolist()
+
+    for i in range(len(row_list)):
+        idx = start + i
+        row = row_list[i]
+
+        # Layer change marker
+        if row != current_row:
+            current_row = row
+            buf += (b";LAYER_CHANGE\n;Z:" + place3[row] + b"\n"
+                    + _LAYER_HEIGHT_LINE)
+            if comments:
+                buf += b"; --- Layer %d/%d ---\n" % (row + 1, size_y)
+
+        # Progress only when the integer percentage actually advances —
+        # ~100 M73 lines per file instead of one per brick.
+        pct = idx * 100 // total
+        if pct != last_pct:
+            last_pct = pct
+            buf += b"M73 P%d R0 Q%d S0  ; progress %d%%\n" % (pct, pct, pct)
+
+        # Entire pick/place cycle (banner + moves) in one bytes-% append
+        col_x = col_x_list[i]
+        col_y = col_y_list[i]
+        if comments:
+            buf += _BRICK_TEMPLATE % (
+                idx + 1, total, col_x, col_y, row, x1[col_x], y1[col_y],
+                z1[row], x3[col_x], y3[col_y], col_x, col_y, row,
+                appr3[row], place3[row],
+            )
+        else:
+            buf += _BRICK_TEMPLATE_COMPACT % (
+                x3[col_x], y3[col_y], col_x, col_y, row,
+                appr3[row], place3[row],
+            )
+
+    # Return the bytearray as-is: file.write and pickle both take it
+    # directly, and a bytes() round-trip would copy the whole band.
+    return buf
+
+
+def generate_gcode(blocks, size_x: int, size_y: int, size_z: int, out) -> None:
+    """Write G-code for `blocks` to the binary file-like `out`.
+
+    All emission is pure-ASCII-plus-UTF-8 bytes accumulated in a bytearray
+    and flushed in ~1 MiB batches — no per-line text encoding.
+    """
+    buf = bytearray()
 
     def emit(*args):
-        lines.extend(args)
-
-    def move(x=None, y=None, z=None, e=None, feed=None, comment=""):
-        is_extrude = e is not None
-        parts = ["G1" if is_extrude or (feed is not None and feed < FEED_APPROACH) else "G0"]
-        if x    is not None: parts.append(f"X{x:.3f}")
-        if y    is not None: parts.append(f"Y{y:.3f}")
-        if z    is not None: parts.append(f"Z{z:.3f}")
-        if e    is not None: parts.append(f"E{e:.4f}")
-        if feed is not None: parts.append(f"F{int(feed)}")
-        if comment:          parts.append(f"; {comment}")
-        lines.append(" ".join(parts))
+        for a in args:
+            buf.extend(a.encode("utf-8") if isinstance(a, str) else a)
+            buf.extend(b"\n")
 
     total = len(blocks)
 
@@ -207,99 +551,82 @@ def generate_gcode(blocks, size_x: int, size_y: int, size_z: int) -> str:
     )
 
     # ── Start G-code (identical to message.py) ────────────────────────────────
-    emit(
-        "M73 P0 R0 Q0 S0        ; progress: 0%",
-        "M201 X1000 Y1000 Z200  ; max accelerations [mm/s^2]",
-        "M203 X200 Y200 Z12     ; max feedrates [mm/s]",
-        "M204 P1250 T1250       ; print / travel acceleration [mm/s^2]",
-        "M205 X8.00 Y8.00 Z0.40 ; jerk limits [mm/s]",
-        "G21                    ; units: millimetres",
-        "G90                    ; absolute positioning",
-        "G28 X Y                ; home X and Y",
-        "G92 X-11 Y-7           ; offset origin to working zero",
-        "G92 Z3.8               ; declare current Z (manually parked before run)",
-        "M211 S0                ; disable software endstops — allow negative Z",
-        "M83                    ; relative extruder mode",
-        "G92 E0                 ; reset extruder position",
-        "",
-    )
-    move(z=SAFE_Z, feed=FEED_TRAVEL, comment="raise to safe travel height")
-    emit(";TYPE:Travel", "")
-
-    # Sort: bottom layer first (row ascending), then front-to-back (col_y), then left-to-right (col_x)
-    sorted_blocks = sorted(blocks, key=lambda b: (b[2], b[1], b[0]))
-
-    current_row = -1
-
-    for idx, (col_x, col_y, row) in enumerate(sorted_blocks):
-        target_x = brick_x(col_x)
-        target_y = brick_y(col_y)
-        place_z  = placement_nozzle_z(row)
-        appr_z   = approach_nozzle_z(row)
-        travel_z = SAFE_Z
-
-        # Layer change marker
-        if row != current_row:
-            current_row = row
-            emit(
-                ";LAYER_CHANGE",
-                f";Z:{place_z:.3f}",
-                f";HEIGHT:{BRICK_HEIGHT:.3f}",
-                f"; --- Layer {row + 1}/{size_y} ---",
-            )
-
-        pct = int(round(idx / total * 100))
-        emit(f"M73 P{pct} R0 Q{pct} S0  ; progress {pct}%")
-        emit(f"; ── Brick {idx+1:4d}/{total}  col_x={col_x}  col_y={col_y}  row={row}"
-             f"  →  X={target_x:.1f}  Y={target_y:.1f}  Z={place_z:.1f} ──")
-
-        # 1. Pick up from RED dispenser
-        emit(";    [pick-up RED]", ";TYPE:Travel")
-        move(x=DISPENSER["x"], y=DISPENSER["y"], feed=FEED_TRAVEL,
-             comment="move over RED dispenser")
-        move(z=DISPENSER["z"], feed=FEED_APPROACH,
-             comment="descend to grab height")
-        emit(f"G4 P{DISPENSER_DWELL}  ; dwell — let block seat in socket")
-        move(z=travel_z, feed=FEED_CARRY, comment="rise with brick")
-        emit("")
-
-        # 2. Travel to target XY
-        emit(";    [travel to brick]", ";TYPE:Custom")
-        move(x=target_x, y=target_y, e=0.05, feed=FEED_CARRY,
-             comment=f"position over col_x={col_x} col_y={col_y} row={row}")
-        emit("G92 E0   ; reset E after travel mark")
-        emit("")
-
-        # 3. Approach
-        emit(";    [place]", ";TYPE:Travel")
-        move(z=appr_z, feed=FEED_APPROACH,
-             comment=f"slow approach ({APPROACH_CLEARANCE:.0f} mm above target)")
-
-        # 4. Push onto studs
-        move(z=place_z, feed=FEED_PUSH, comment="push brick onto studs")
-        emit("G4 P200  ; dwell 200 ms — ensure engagement")
-
-        # 5. Retract
-        emit(";TYPE:Travel")
-        move(z=travel_z, feed=FEED_TRAVEL, comment="retract to travel height")
-        emit("")
+    buf += _START_GCODE
+    buf += _FMT_G0_Z % (SAFE_Z, FEED_TRAVEL, b"raise to safe travel height")
+    if EMIT_COMMENTS:
+        emit(";TYPE:Travel", "")
+
+    # Sort: bottom layer first (row ascending), then front-to-back (col_y), then
+    # left-to-right (col_x).  Packing the key as row<<32 | col_y<<16 | col_x
+    # (primary key in the high bits) lets np.sort do the whole ordering in C
+    # with no Python key callable.
+    packed = ((blocks[:, 2].astype(np.uint64) << 32)
+              | (blocks[:, 1].astype(np.uint64) << 16)
+              | blocks[:, 0].astype(np.uint64))
+    packed.sort()
+    row_arr   = (packed >> 32).astype(np.int32)
+    col_y_arr = ((packed >> 16) & 0xFFFF).astype(np.int32)
+    col_x_arr = (packed & 0xFFFF).astype(np.int32)
+
+    # Every coordinate the emit loop needs is one of size_x+size_z+size_y
+    # distinct values, so format each exactly once into a byte token —
+    # ~hundreds of float formats total instead of several per brick.
+    x1     = [b"%.1f" % brick_x(c) for c in range(size_x)]
+    y1     = [b"%.1f" % brick_y(c) for c in range(size_z)]
+    z1     = [b"%.1f" % placement_nozzle_z(r) for r in range(size_y)]
+    x3     = [b"%.3f" % brick_x(c) for c in range(size_x)]
+    y3     = [b"%.3f" % brick_y(c) for c in range(size_z)]
+    appr3  = [b"%.3f" % approach_nozzle_z(r) for r in range(size_y)]
+    place3 = [b"%.3f" % placement_nozzle_z(r) for r in range(size_y)]
+
+    # Per-brick formatting is a pure function of each band of the sorted
+    # arrays, so big jobs fan out across processes; band boundary state
+    # (previous row / percentage) is passed in to keep markers exact.
+    ncpu = os.cpu_count() or 1
+    if total >= _PARALLEL_MIN_BRICKS and ncpu > 1:
+        out.write(buf)
+        del buf[:]
+        bounds = [(b * total) // ncpu for b in range(ncpu + 1)]
+        with ProcessPoolExecutor() as ex:
+            futures = [
+                ex.submit(_format_band,
+                          col_x_arr[s:e], col_y_arr[s:e], row_arr[s:e],
+                          x1, y1, z1, x3, y3, appr3, place3,
+                          s, total, size_y,
+                          int(row_arr[s - 1]) if s else -1,
+                          ((s - 1) * 100 // total) if s else -1,
+                          EMIT_COMMENTS)
+                for s, e in zip(bounds, bounds[1:]) if s < e
+            ]
+            for fut in futures:
+                out.write(fut.result())
+    else:
+        for s in range(0, total, _BAND_BRICKS):
+            e = min(s + _BAND_BRICKS, total)
+            buf += _format_band(
+                col_x_arr[s:e], col_y_arr[s:e], row_arr[s:e],
+                x1, y1, z1, x3, y3, appr3, place3,
+                s, total, size_y,
+                int(row_arr[s - 1]) if s else -1,
+                ((s - 1) * 100 // total) if s else -1,
+                EMIT_COMMENTS)
+            if len(buf) >= _FLUSH_BYTES:
+                out.write(buf)
+                del buf[:]
 
     # ── End G-code ────────────────────────────────────────────────────────────
     final_z = min(SAFE_Z + 10.0, 210.0)
-    emit(
-        "M73 P100 R0 Q100 S0  ; progress: 100%",
-        "",
-        "; ── All bricks placed ──────────────────────────────────────",
-        ";TYPE:Travel",
-    )
-    move(z=final_z, feed=720, comment="raise nozzle clear of structure")
-    emit(
-        "M211 S1      ; re-enable software endstops",
-        "M84          ; disable steppers",
-        "",
-    )
+    emit("M73 P100 R0 Q100 S0  ; progress: 100%")
+    if EMIT_COMMENTS:
+        emit(
+            "",
+            "; ── All bricks placed ──────────────────────────────────────",
+            ";TYPE:Travel",
+        )
+    buf += _FMT_G1_Z % (final_z, 720, b"raise nozzle clear of structure")
+    buf += _END_GCODE
 
-    return "\n".join(lines)
+    out.write(buf)
 
 
 # ═══════════════════════════════════════════════════════════════════════════════
@@ -307,12 +634,17 @@ def generate_gcode(blocks, size_x: int, size_y: int, size_z: int) -> str:
 # ═══════════════════════════════════════════════════════════════════════════════
 
 def main():
-    if len(sys.argv) < 2:
+    global EMIT_COMMENTS
+    args = [a for a in sys.argv[1:] if a != "--compact"]
+    if len(args) < len(sys.argv) - 1:
+        EMIT_COMMENTS = False
+
+    if not args:
         print(__doc__)
-        sys.exit("Usage: python gcode_3d.py <structure.nbt> [output.gcode]")
+        sys.exit("Usage: python gcode_3d.py [--compact] <structure.nbt> [output.gcode]")
 
-    nbt_path = sys.argv[1]
-    out_path = sys.argv[2] if len(sys.argv) > 2 else Path(nbt_path).stem + ".gcode"
+    nbt_path = args[0]
+    out_path = args[1] if len(args) > 1 else Path(nbt_path).stem + ".gcode"
 
     print("=" * 60)
     print("  gcode_3d  —  Minecraft 3D Structure → LEGO G-code")
@@ -327,16 +659,14 @@ def main():
           f"{size_z * BRICK_WIDTH:.0f} mm deep × "
           f"{size_y * BRICK_HEIGHT:.0f} mm tall")
 
-    if not blocks:
+    if len(blocks) == 0:
         sys.exit("No non-air blocks found.")
 
     print_preview(blocks, size_x, size_y, size_z)
 
     print(f"\n  Generating G-code …")
-    gcode = generate_gcode(blocks, size_x, size_y, size_z)
-
-    with open(out_path, "w") as f:
-        f.write(gcode)
+    with open(out_path, "wb", buffering=1 << 20) as f:
+        generate_gcode(blocks, size_x, size_y, size_z, f)
 
     print(f"  Written → {out_path}")
     print("=" * 60)
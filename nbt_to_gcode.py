@@ -36,9 +36,9 @@ Pick / place cycle  (per brick)
   7. Push to placement depth at FEED_PUSH — block engages studs and stays
   8. Rise to SAFE_Z
 
-Dependency
-----------
-  pip install nbtlib
+Dependencies
+------------
+  pip install nbtlib numpy
 
 Usage
 -----
@@ -47,14 +47,34 @@ Usage
   python nbt_to_gcode.py build.nbt wall.gcode    # → wall.gcode
 """
 
+import argparse
+import hashlib
+import io
+import mmap
+import os
+import shutil
 import sys
-from pathlib import Path
+from concurrent.futures import ProcessPoolExecutor
+from dataclasses import dataclass
+from functools import lru_cache
 
 try:
     import nbtlib
 except ImportError:
     sys.exit("Missing dependency — install it with:  pip install nbtlib")
 
+try:
+    import numpy as np
+except ImportError:
+    sys.exit("Missing dependency — install it with:  pip install numpy")
+
+# Numba is optional — when available, the first-occurrence dedupe in
+# parse_structure runs as a compiled kernel; otherwise a NumPy fallback is used.
+try:
+    import numba
+except ImportError:
+    numba = None
+
 
 # ═══════════════════════════════════════════════════════════════════════════════
 #  PHYSICAL CONFIGURATION  ← edit these values to match your printer / setup
@@ -78,6 +98,13 @@ DISPENSERS = {
 }
 DISPENSER_DWELL  = 500    # ms   Pause at pick-up Z (lets block seat in socket)
 
+# Colours travel through the pipeline as small ints (array-friendly, no string
+# compares in the brick loop); names are only materialized for comments.
+RED, YELLOW    = 0, 1
+COLOR_NAME     = ("RED", "YELLOW")            # code → name
+COLOR_CODE     = {"RED": RED, "YELLOW": YELLOW}
+DISPENSER_LIST = (DISPENSERS["RED"], DISPENSERS["YELLOW"])   # code → dispenser
+
 # ── LEGO wall position ────────────────────────────────────────────────────────
 # Wall runs parallel to the Y axis — columns spread along Y, rows go down in Z.
 #   WALL_X   = fixed X position for every brick
@@ -121,6 +148,27 @@ FEED_APPROACH    = 1500   # mm/min  slow descent before placement zone
 FEED_PUSH        = 300    # mm/min  very slow final push onto studs
 APPROACH_CLEARANCE = 6.0  # mm   start slowing this far above nominal place Z
 
+# ── Output options ────────────────────────────────────────────────────────────
+# The trailing PrusaSlicer config block is ~240 comment lines (~6 kB).  Turn
+# this off to emit a minimal block (bed shape + layer heights only) when
+# streaming small jobs over serial / OctoPrint, where the fixed preamble
+# dominates upload time.
+GENERATE_FULL_PREAMBLE = True
+
+
+# Speed overrides (e.g. trial_run.py) travel as an explicit MotionConfig rather
+# than monkey-patched module globals — the brick-cycle template bakes feed rates
+# in at build time, so globals mutated after import would silently go stale.
+@dataclass(frozen=True, slots=True)
+class MotionConfig:
+    feed_travel:   int = FEED_TRAVEL
+    feed_carry:    int = FEED_CARRY
+    feed_approach: int = FEED_APPROACH
+    feed_push:     int = FEED_PUSH
+
+
+DEFAULT_CFG = MotionConfig()
+
 # ═══════════════════════════════════════════════════════════════════════════════
 #  MINECRAFT AXIS MAPPING
 # ═══════════════════════════════════════════════════════════════════════════════
@@ -265,17 +313,62 @@ BLOCK_COLOR_MAP: dict[str, str] = {
 #  PARSING
 # ═══════════════════════════════════════════════════════════════════════════════
 
+if numba is not None:
+    @numba.njit(cache=True)
+    def _dedup_first(cols, rows, num_cols, num_rows):
+        """First-occurrence index of every occupied (col, row) cell, in input
+        order — tight integer loop over an occupancy bitmap."""
+        seen = np.zeros(num_rows * num_cols, dtype=np.uint8)
+        keep = np.empty(cols.shape[0], dtype=np.int64)
+        n = 0
+        for i in range(cols.shape[0]):
+            key = rows[i] * num_cols + cols[i]
+            if seen[key] == 0:
+                seen[key] = 1
+                keep[n] = i
+                n += 1
+        return keep[:n]
+
+
 def parse_structure(nbt_path: str):
     """
     Parse a Minecraft .nbt structure file.
 
     Returns
     -------
-    blocks   : list of (col, row, color) tuples for every non-air block
-               color is "RED" or "YELLOW" (resolved via BLOCK_COLOR_MAP)
+    blocks   : (cols, rows, colors) — parallel NumPy arrays (int32 column /
+               row indices, int8 RED/YELLOW colour codes), one entry per
+               non-air block (resolved via BLOCK_COLOR_MAP)
     num_cols : total column count (width)
     num_rows : total row count (height)
     """
+    # ── Sidecar cache — skip the NBT parse entirely on repeat runs ────────────
+    # Iterative workflows (trial_run.py, speed tweaking) regenerate G-code from
+    # the same structure over and over; the parsed SoA arrays are stashed in an
+    # .npz next to the NBT.  The stored colours are *derived* through the
+    # user-editable tables above, so the stamp covers a digest of those tables
+    # and the MC_* axis settings alongside the source file's mtime + size.
+    # Tool-specific suffix: gcode_3d.py keeps its own sidecar with a different
+    # schema, so sharing a filename would just make each run evict the other's.
+    cache_path = nbt_path + ".nbt_to_gcode.cache.npz"
+    st = os.stat(nbt_path)
+    cfg_digest = hashlib.sha1(repr((
+        sorted(BLOCK_COLOR_MAP.items()), DEFAULT_LEGO_COLOR, sorted(AIR_BLOCKS),
+        MC_COL_AXIS, MC_ROW_AXIS, MC_DEPTH_AXIS, MC_DEPTH_SLICE,
+    )).encode()).digest()
+    stamp = np.array([st.st_mtime_ns, st.st_size,
+                      int.from_bytes(cfg_digest[:8], "big", signed=True)],
+                     dtype=np.int64)
+    try:
+        with np.load(cache_path) as npz:
+            if np.array_equal(npz["stamp"], stamp):
+                blocks = (npz["cols"], npz["rows"], npz["colors"])
+                meta   = npz["meta"]
+                print(f"  Loading cached parse: {cache_path}")
+                return blocks, int(meta[0]), int(meta[1])
+    except (OSError, KeyError, ValueError):
+        pass  # missing / stale / corrupt sidecar — parse normally below
+
     print(f"  Loading NBT: {nbt_path}")
     nbt = nbtlib.load(nbt_path)
 
@@ -295,32 +388,70 @@ def parse_structure(nbt_path: str):
     elif depth > 1 and MC_DEPTH_SLICE is None:
         print(f"  NOTE: structure is {depth} blocks deep; merging all depth slices.")
 
-    unmapped: set[str] = set()
-    seen: dict[tuple, str] = {}   # (col, row) → color
-    blocks = []
-
-    for blk in raw_blocks:
-        pos       = blk["pos"]
-        state_idx = int(blk["state"])
-        name      = str(palette[state_idx]["Name"])
-
-        if name in AIR_BLOCKS:
-            continue
-
-        depth_val = int(pos[MC_DEPTH_AXIS])
-        if MC_DEPTH_SLICE is not None and depth_val != MC_DEPTH_SLICE:
-            continue
-
-        col = int(pos[MC_COL_AXIS])
-        row = int(pos[MC_ROW_AXIS])
-
-        if name not in BLOCK_COLOR_MAP:
-            unmapped.add(name)
-        color = BLOCK_COLOR_MAP.get(name, DEFAULT_LEGO_COLOR)
-
-        if (col, row) not in seen:
-            seen[(col, row)] = color
-            blocks.append((col, row, color))
+    # ── Palette tables — resolve each palette entry ONCE, not once per block ──
+    # Interned names hit the identity fast path in the dict/set lookups below
+    # (BLOCK_COLOR_MAP keys are interned string literals already).
+    palette_names    = [sys.intern(str(p["Name"])) for p in palette]
+    palette_color    = tuple(COLOR_CODE[BLOCK_COLOR_MAP.get(n, DEFAULT_LEGO_COLOR)]
+                             for n in palette_names)
+    palette_is_air   = np.array([n in AIR_BLOCKS for n in palette_names], dtype=bool)
+    palette_unmapped = tuple(n not in BLOCK_COLOR_MAP for n in palette_names)
+
+    # ── Extract positions / state indices into flat int32 arrays (single fill
+    #    pass; all filtering below is vectorized C-level work) ─────────────────
+    n_raw  = len(raw_blocks)
+    pos    = np.empty((n_raw, 3), dtype=np.int32)
+    states = np.empty(n_raw, dtype=np.int32)
+    for i, blk in enumerate(raw_blocks):
+        # Unpack the pos tag once — three __getitem__ calls on an nbtlib List
+        # do per-element type unwrapping; a single unpack iterates it once.
+        px, py, pz = blk["pos"]
+        pos[i, 0] = int(px)
+        pos[i, 1] = int(py)
+        pos[i, 2] = int(pz)
+        states[i] = int(blk["state"])
+
+    keep = ~palette_is_air[states]
+    if MC_DEPTH_SLICE is not None:
+        keep &= pos[:, MC_DEPTH_AXIS] == MC_DEPTH_SLICE
+
+    cols_arr   = pos[keep, MC_COL_AXIS]
+    rows_arr   = pos[keep, MC_ROW_AXIS]
+    states_arr = states[keep]
+
+    # A malformed pos outside the declared size would index past the dedup
+    # bitmap (unchecked in numba's nopython mode) and blow up the colour-grid
+    # stamp in write_gcode — drop such blocks up front, mirroring the bounds
+    # check print_preview already does.
+    in_bounds = ((cols_arr >= 0) & (cols_arr < num_cols)
+                 & (rows_arr >= 0) & (rows_arr < num_rows))
+    if not in_bounds.all():
+        n_oob = int(in_bounds.size) - int(np.count_nonzero(in_bounds))
+        print(f"  NOTE: {n_oob} block(s) outside the declared "
+              f"{num_cols}×{num_rows} structure size — ignored.")
+        cols_arr   = cols_arr[in_bounds]
+        rows_arr   = rows_arr[in_bounds]
+        states_arr = states_arr[in_bounds]
+
+    unmapped = {palette_names[s] for s in np.unique(states_arr).tolist()
+                if palette_unmapped[s]}
+
+    # ── Dedupe: first block per (col, row) cell wins ──────────────────────────
+    if numba is not None:
+        first = _dedup_first(cols_arr, rows_arr, num_cols, num_rows)
+    else:
+        # np.unique on a packed (row·num_cols + col) key finds the first index
+        # of every occupied cell in one C pass; re-sorting those indices
+        # restores the original block order so first-occurrence wins.
+        packed   = rows_arr.astype(np.int64) * num_cols + cols_arr
+        _, first = np.unique(packed, return_index=True)
+        first.sort()
+
+    cols_arr   = cols_arr[first]
+    rows_arr   = rows_arr[first]
+    states_arr = states_arr[first]
+
+    colors = np.array(palette_color, dtype=np.int8)[states_arr]
 
     if unmapped:
         print(f"  NOTE: {len(unmapped)} unmapped block type(s) → defaulting to "
@@ -328,7 +459,15 @@ def parse_structure(nbt_path: str):
         for name in sorted(unmapped):
             print(f"        {name}")
 
-    return blocks, num_cols, num_rows
+    try:
+        np.savez(cache_path,
+                 cols=cols_arr, rows=rows_arr, colors=colors,
+                 meta=np.array([num_cols, num_rows], dtype=np.int64),
+                 stamp=stamp)
+    except OSError:
+        pass  # read-only directory — the cache is purely best-effort
+
+    return (cols_arr, rows_arr, colors), num_cols, num_rows
 
 
 # ═══════════════════════════════════════════════════════════════════════════════
@@ -338,22 +477,25 @@ def parse_structure(nbt_path: str):
 def print_preview(blocks, num_cols, num_rows):
     """Print a colour-coded ASCII preview of the parsed wall (row 0 at bottom).
     R = red brick, Y = yellow brick, . = air."""
-    COLOR_CHAR = {"RED": "R", "YELLOW": "Y"}
-    grid = [['.' for _ in range(num_cols)] for _ in range(num_rows)]
-    for col, row, color in blocks:
+    cols, rows, colors = blocks
+    # One flat byte buffer instead of a list-of-lists of 1-char strings —
+    # a 200×200 wall is a single 40 kB allocation, not 40k PyObjects.
+    grid = bytearray(b"." * (num_rows * num_cols))
+    for col, row, color in zip(cols.tolist(), rows.tolist(), colors.tolist()):
         if 0 <= row < num_rows and 0 <= col < num_cols:
-            grid[row][col] = COLOR_CHAR.get(color, "?")
+            grid[row * num_cols + col] = 0x52 if color == RED else 0x59  # R / Y
 
     preview_cols = min(num_cols, 80)
-    print(f"\n  Preview (row 0 = bottom,  R = red  Y = yellow  . = air):")
+    ellipsis = '…' if num_cols > 80 else ''
+    # Assemble the whole preview first and emit it as one write — a tall wall
+    # is hundreds of print() calls otherwise, each locking and flushing stdout.
+    lines = ["", "  Preview (row 0 = bottom,  R = red  Y = yellow  . = air):"]
     for row in range(num_rows - 1, -1, -1):
-        line = ''.join(grid[row][:preview_cols])
-        if num_cols > 80:
-            line += '…'
-        print(f"  {row:3d}│{line}")
-    print(f"     └{'─' * preview_cols}")
-    col_label = '0' + ' ' * (preview_cols - 1)
-    print(f"      {col_label}")
+        start = row * num_cols
+        lines.append(f"  {row:3d}│{grid[start:start + preview_cols].decode()}{ellipsis}")
+    lines.append(f"     └{'─' * preview_cols}")
+    lines.append(f"      0{' ' * (preview_cols - 1)}")
+    sys.stdout.write("\n".join(lines) + "\n")
 
 
 # ═══════════════════════════════════════════════════════════════════════════════
@@ -361,12 +503,14 @@ def print_preview(blocks, num_cols, num_rows):
 # ═══════════════════════════════════════════════════════════════════════════════
 # Origin is top-right.  X decreases leftward; Z decreases downward.
 
+@lru_cache(maxsize=None)
 def brick_y(col: int) -> float:
     """Nozzle Y for a given column. Col 0 = front (WALL_ORIGIN_Y), col N = further back.
     Spaced by BRICK_WIDTH (8 mm = 1 stud) along Y."""
     return WALL_ORIGIN_Y + col * BRICK_WIDTH
 
 
+@lru_cache(maxsize=None)
 def placement_nozzle_z(row: int) -> float:
     """
     Nozzle Z (mm) at the moment the brick is pushed onto studs.
@@ -379,6 +523,7 @@ def placement_nozzle_z(row: int) -> float:
     return brick_top_target - NOZZLE_TO_BRICK_BOTTOM - PUSH_EXTRA
 
 
+@lru_cache(maxsize=None)
 def approach_nozzle_z(row: int) -> float:
     """Nozzle Z to slow down at before the final push (above placement Z)."""
     return placement_nozzle_z(row) + APPROACH_CLEARANCE
@@ -388,441 +533,714 @@ def approach_nozzle_z(row: int) -> float:
 #  G-CODE GENERATION
 # ═══════════════════════════════════════════════════════════════════════════════
 
-def generate_gcode(blocks, num_cols: int, num_rows: int) -> str:
-    lines = []
-
-    def emit(*args):
-        lines.extend(args)
-
-    def move(x=None, y=None, z=None, e=None, feed=None, comment=""):
-        # Force G1 when E is present (viewer requires G1 to render extrusion paths)
-        is_extrude = e is not None
-        parts = ["G1" if is_extrude or (feed is not None and feed < FEED_APPROACH) else "G0"]
-        if x is not None: parts.append(f"X{x:.3f}")
-        if y is not None: parts.append(f"Y{y:.3f}")
-        if z is not None: parts.append(f"Z{z:.3f}")
-        if e is not None: parts.append(f"E{e:.4f}")
-        if feed is not None: parts.append(f"F{int(feed)}")
-        if comment: parts.append(f"; {comment}")
-        lines.append(" ".join(parts))
-
-    n_red    = sum(1 for _, _, c in blocks if c == "RED")
-    n_yellow = sum(1 for _, _, c in blocks if c == "YELLOW")
-    total    = len(blocks)
-
-    from datetime import datetime, timezone
-    timestamp = datetime.now(timezone.utc).strftime("%Y-%m-%d at %H:%M:%S UTC")
+# ── PrusaSlicer config block — the bulk never changes, so it lives in a few
+#    module-level bytes constants built once at import.  Only the handful of
+#    lines that interpolate brick dimensions are formatted per run (see the
+#    tail of generate_gcode).  NOTE: some lines carry a significant trailing
+#    space (empty-valued keys) — preserved inside the literals below.
+_PRUSA_CFG_HEAD = b"""; prusaslicer_config = begin
+; avoid_crossing_perimeters = 0
+; avoid_crossing_perimeters_max_detour = 0
+; bottom_fill_pattern = monotonic
+; bottom_solid_layers = 3
+; bottom_solid_min_thickness = 0
+; bridge_acceleration = 0
+; bridge_angle = 0
+; bridge_fan_speed = 100
+; bridge_flow_ratio = 1
+; bridge_speed = 60
+; brim_ears = 0
+; brim_ears_detection_length = 1
+; brim_ears_max_angle = 125
+; brim_separation = 0
+; brim_type = no_brim
+; brim_width = 0
+; clip_multipart_objects = 1
+; colorprint_heights = 
+; complete_objects = 0
+; cooling = 1
+; default_acceleration = 0
+; disable_fan_first_layers = 3
+; dont_support_bridges = 1
+; draft_shield = disabled
+; draft_shield_distance = 10
+; duplicate_distance = 6
+; elefant_foot_compensation = 0
+; elefant_foot_min_width = 0.2
+; end_gcode = M84
+; external_perimeter_extrusion_width = 0.45
+; external_perimeter_speed = 25
+; external_perimeters_first = 0
+; extruder_clearance_height = 20
+; extruder_clearance_radius = 20
+; extrusion_multiplier = 1
+"""
 
-    # ── PrusaSlicer-compatible file header ────────────────────────────────────
-    emit(
-        f"; generated by PrusaSlicer 2.9.4 on {timestamp}",
-        "; prusaslicer:gcode_flavor = marlin2",
-        "; prusaslicer:printer_model = MK3S",
-        f"; layer_count = {num_rows}",
-        "; estimated printing time (normal mode) = 0s",
-        "; filament used [mm] = 0",
-        "; nozzle_diameter = 0",
-        "; total_toolchanges = 0",
-        "; ============================================================",
-        f"; LEGO Wall G-code  —  generated by nbt_to_gcode.py",
-        f"; Structure  : {num_cols} cols wide × {num_rows} rows tall",
-        f"; Bricks     : {total} total  ({n_red} red, {n_yellow} yellow)",
-        f"; Brick face : {BRICK_WIDTH:.0f} mm wide × {BRICK_HEIGHT} mm tall  (short / square end faces out)",
-        f"; Wall depth : 16 mm  (2 studs — long axis of brick points inward)",
-        f"; Wall X     : {WALL_X:.1f} mm (fixed)",
-        f"; Wall Y     : {WALL_ORIGIN_Y:.1f} mm (front) → {WALL_ORIGIN_Y + (num_cols - 1) * BRICK_DEPTH:.1f} mm (back)",
-        f"; Wall Z     : {WALL_ORIGIN_Z:.1f} (top) → {WALL_ORIGIN_Z - num_rows * BRICK_HEIGHT:.1f} mm (bottom)",
-        f"; Disp RED   : X={DISPENSERS['RED']['x']}  Y={DISPENSERS['RED']['y']}  Z={DISPENSERS['RED']['z']}",
-        f"; Disp YELLOW: X={DISPENSERS['YELLOW']['x']}  Y={DISPENSERS['YELLOW']['y']}  Z={DISPENSERS['YELLOW']['z']}",
-        "; ============================================================",
-        "",
-    )
-
-    # ── Prusa i3 MK3 start G-code ─────────────────────────────────────────────
-    emit(
-        "M73 P0 R0 Q0 S0        ; progress: 0% (normal + stealth modes)",
-        "M201 X1000 Y1000 Z200  ; max accelerations [mm/s^2] — no E (no extruder)",
-        "M203 X200 Y200 Z12     ; max feedrates [mm/s]",
-        "M204 P1250 T1250       ; print / travel acceleration [mm/s^2]",
-        "M205 X8.00 Y8.00 Z0.40 ; jerk limits [mm/s]",
-        "G21                    ; units: millimetres",
-        "G90                    ; absolute positioning",
-        "G28 X Y                ; home X and Y (bottom-left = origin)",
-        "G92 Z0                 ; declare current Z as Z=0 (manually parked before run)",
-        "M211 S0                ; disable software endstops — allow negative Z",
-        "; NOTE: M104/M109/M140/M190 omitted — no hotend/bed on this machine",
-        "M83                    ; relative extruder mode (E values are incremental)",
-        "G92 E0                 ; reset extruder position",
-        "",
-    )
-    move(z=SAFE_Z, feed=FEED_TRAVEL, comment="raise to safe travel height")
-    emit(";TYPE:Travel", "")
+_PRUSA_CFG_MID1 = b"""; fan_always_on = 1
+; fan_below_layer_time = 100
+; fill_angle = 45
+; fill_density = 15%
+; fill_pattern = gyroid
+; first_layer_acceleration = 0
+; first_layer_extrusion_width = 0.42
+; first_layer_height = 0.2
+; first_layer_speed = 30
+; gap_fill_enabled = 1
+; gap_fill_speed = 20
+; gcode_comments = 0
+; gcode_flavor = marlin2
+; gcode_label_objects = 1
+; infill_acceleration = 0
+; infill_every_layers = 1
+; infill_extruder = 1
+; infill_extrusion_width = 0.45
+; infill_first = 0
+; infill_only_where_needed = 0
+; infill_overlap = 25%
+; infill_speed = 80
+; interface_shells = 0
+; ironing = 0
+; ironing_flowrate = 15%
+; ironing_spacing = 0.1
+; ironing_speed = 15
+; ironing_type = top
+; layer_gcode = 
+"""
 
-    # Sort: top row first (row 0 = top, builds downward), right to left mirrors natural X order
-    sorted_blocks = sorted(blocks, key=lambda b: (b[1], -b[0]))
+_PRUSA_CFG_MID2 = b"""; max_print_speed = 200
+; max_volumetric_extrusion_rate_slope_negative = 0
+; max_volumetric_extrusion_rate_slope_positive = 0
+; max_volumetric_speed = 0
+; min_print_speed = 15
+; min_skirt_length = 4
+; notes = 
+; only_retract_when_crossing_perimeters = 0
+; ooze_prevention = 0
+; output_filename_format = {input_filename_base}.gcode
+; overhangs = 1
+; perimeter_acceleration = 0
+; perimeter_extruder = 1
+; perimeter_extrusion_width = 0.45
+; perimeter_speed = 45
+; perimeters = 2
+; post_process = 
+; print_settings_id = 
+; resolution = 0
+; seam_position = aligned
+; skirt_distance = 6
+; skirt_height = 1
+; skirts = 0
+; slowdown_below_layer_time = 5
+; solid_infill_below_area = 70
+; solid_infill_every_layers = 0
+; solid_infill_extruder = 1
+; solid_infill_extrusion_width = 0.45
+; solid_infill_speed = 20
+; spiral_vase = 0
+; standby_temperature_delta = -5
+; support_material = 0
+; support_material_angle = 0
+; support_material_auto = 1
+; support_material_buildplate_only = 0
+; support_material_contact_distance = 0.2
+; support_material_enforce_layers = 0
+; support_material_extruder = 0
+; support_material_extrusion_width = 0.35
+; support_material_interface_contact_loops = 0
+; support_material_interface_extruder = 0
+; support_material_interface_layers = 2
+; support_material_interface_pattern = rectilinear
+; support_material_interface_spacing = 0.2
+; support_material_interface_speed = 100%
+; support_material_pattern = rectilinear
+; support_material_spacing = 2
+; support_material_speed = 50
+; support_material_style = grid
+; support_material_synchronize_layers = 0
+; support_material_threshold = 55
+; support_material_with_sheath = 0
+; support_material_xy_spacing = 60%
+; thick_bridges = 1
+; thin_walls = 1
+; threads = 4
+; toolchange_gcode = 
+; top_fill_pattern = monotonic
+; top_infill_extrusion_width = 0.45
+; top_solid_infill_speed = 15
+; top_solid_layers = 3
+; top_solid_min_thickness = 0
+; travel_speed = 120
+; travel_speed_z = 0
+; use_firmware_retraction = 0
+; use_relative_e_distances = 1
+; use_volumetric_e = 0
+; variable_layer_height = 0
+; wipe_tower = 0
+; wipe_tower_bridging = 10
+; wipe_tower_brim_width = 2
+; wipe_tower_no_sparse_layers = 0
+; wipe_tower_rotation_angle = 0
+; wipe_tower_width = 60
+; wipe_tower_x = 170
+; wipe_tower_y = 140
+; xy_size_compensation = 0
+; filament_colour = #FF8000
+; filament_cooling_final_speed = 3.4
+; filament_cooling_initial_speed = 2.2
+; filament_cooling_moves = 4
+; filament_cost = 0
+; filament_density = 0
+; filament_diameter = 1.75
+; filament_load_time = 0
+; filament_loading_speed = 28
+; filament_loading_speed_start = 3
+; filament_max_volumetric_speed = 0
+; filament_minimal_purge_on_wipe_tower = 15
+; filament_notes = 
+; filament_settings_id = 
+; filament_soluble = 0
+; filament_spool_weight = 0
+; filament_toolchange_delay = 0
+; filament_type = PLA
+; filament_unload_time = 0
+; filament_unloading_speed = 90
+; filament_unloading_speed_start = 100
+; first_layer_bed_temperature = 0
+; first_layer_temperature = 0
+; max_fan_speed = 100
+; min_fan_speed = 35
+; temperature = 0
+; before_layer_gcode = 
+; bed_shape = 0x0,250x0,250x210,0x210
+; bed_temperature = 0
+; between_objects_gcode = 
+; cooling_tube_length = 5
+; cooling_tube_retraction = 91.5
+; default_filament_profile = 
+; default_print_profile = 
+; end_filament_gcode = "; Filament-specific end gcode"
+; extra_loading_move = -2
+; extruder_colour = #FF8000
+; extruder_offset = 0x0
+; high_current_on_filament_swap = 0
+; host_type = octoprint
+; machine_limits_usage = time_estimate_only
+; machine_max_acceleration_e = 5000,5000
+; machine_max_acceleration_extruding = 1250,1250
+; machine_max_acceleration_retracting = 1500,1500
+; machine_max_acceleration_travel = 1500,1500
+; machine_max_acceleration_x = 1000,1000
+; machine_max_acceleration_y = 1000,1000
+; machine_max_acceleration_z = 200,200
+; machine_max_feedrate_e = 120,120
+; machine_max_feedrate_x = 200,200
+; machine_max_feedrate_y = 200,200
+; machine_max_feedrate_z = 12,12
+; machine_max_jerk_e = 1.5,1.5
+; machine_max_jerk_x = 8,8
+; machine_max_jerk_y = 8,8
+; machine_max_jerk_z = 0.4,0.4
+; machine_min_extruding_rate = 0,0
+; machine_min_travel_rate = 0,0
+"""
 
-    current_row = -1
+_PRUSA_CFG_TAIL = b"""; nozzle_diameter = 0.4
+; parking_pos_retraction = 92
+; printer_model = MK3S
+; printer_notes = 
+; printer_settings_id = 
+; printer_technology = FFF
+; printer_variant = 0.4
+; printer_vendor = Prusa Research
+; remaining_times = 1
+; retract_before_travel = 2
+; retract_before_wipe = 0%
+; retract_layer_change = 0
+; retract_length = 0.8
+; retract_length_toolchange = 4
+; retract_lift = 0.6
+; retract_lift_above = 0
+; retract_lift_below = 209
+; retract_restart_extra = 0
+; retract_restart_extra_toolchange = 0
+; retract_speed = 35
+; silent_mode = 0
+; single_extruder_multi_material = 0
+; start_filament_gcode = "; Filament gcode"
+; start_gcode = G28 W
+; wipe = 0
+; wipe_into_infill = 0
+; wipe_into_objects = 0
+; prusaslicer_config = end
+"""
 
-    for idx, (col, row, color) in enumerate(sorted_blocks):
-        target_x  = WALL_X
-        target_y  = brick_y(col)
-        place_z   = placement_nozzle_z(row)
-        appr_z    = approach_nozzle_z(row)
-        disp      = DISPENSERS[color]
-        layer_z   = WALL_ORIGIN_Z - row * BRICK_HEIGHT
+# The brick-dimension lines only involve module constants, so the whole config
+# block collapses into one blob written with a single call.  It is assembled
+# lazily on first use (and cached) — import / preview-only runs never pay for
+# the join or the hash.
+@lru_cache(maxsize=None)
+def _prusa_cfg_blob(full: bool) -> bytes:
+    """The trailing config block: the full ~240-line PrusaSlicer block, or a
+    minimal one (bed shape + layer heights) when ``full`` is False.  Both
+    start with a "; config_hash" comment digesting the full block, so the
+    hash identifies the configuration regardless of which form is emitted —
+    downstream tools can compare that one line instead of the whole block."""
+    blob = b"".join((
+        _PRUSA_CFG_HEAD,
+        b"; extrusion_width = %.2f\n" % BRICK_WIDTH,
+        _PRUSA_CFG_MID1,
+        b"; layer_height = %.4f\n" % BRICK_HEIGHT,
+        _PRUSA_CFG_MID2,
+        b"; max_layer_height = %.4f\n" % BRICK_HEIGHT,
+        b"; max_print_height = 210\n",
+        b"; min_layer_height = %.4f\n" % BRICK_HEIGHT,
+        _PRUSA_CFG_TAIL,
+    ))
+    hash_line = b"; config_hash = %s\n" % hashlib.sha1(blob).hexdigest()[:12].encode()
+    if not full:
+        # Minimal form for jobs streamed over serial/OctoPrint, where the
+        # full block dominates upload time on small walls.
+        blob = b"".join((
+            b"; prusaslicer_config = begin\n",
+            b"; bed_shape = 0x0,250x0,250x210,0x210\n",
+            b"; layer_height = %.4f\n" % BRICK_HEIGHT,
+            b"; max_layer_height = %.4f\n" % BRICK_HEIGHT,
+            b"; min_layer_height = %.4f\n" % BRICK_HEIGHT,
+            b"; prusaslicer_config = end\n",
+        ))
+    return hash_line + blob
+
+# ── File header template ──────────────────────────────────────────────────────
+# Lines that only involve module constants are baked in at import time; the
+# %-placeholders are for the handful of per-run values (timestamp, wall size,
+# brick counts).
+_HEADER_TPL = (
+    "; generated by PrusaSlicer 2.9.4 on %s\n"
+    "; prusaslicer:gcode_flavor = marlin2\n"
+    "; prusaslicer:printer_model = MK3S\n"
+    "; layer_count = %d\n"
+    "; estimated printing time (normal mode) = 0s\n"
+    "; filament used [mm] = 0\n"
+    "; nozzle_diameter = 0\n"
+    "; total_toolchanges = 0\n"
+    "; ============================================================\n"
+    "; LEGO Wall G-code  —  generated by nbt_to_gcode.py\n"
+    "; Structure  : %d cols wide × %d rows tall\n"
+    "; Bricks     : %d total  (%d red, %d yellow)\n"
+    f"; Brick face : {BRICK_WIDTH:.0f} mm wide × {BRICK_HEIGHT} mm tall  (short / square end faces out)\n"
+    "; Wall depth : 16 mm  (2 studs — long axis of brick points inward)\n"
+    f"; Wall X     : {WALL_X:.1f} mm (fixed)\n"
+    f"; Wall Y     : {WALL_ORIGIN_Y:.1f} mm (front) → %.1f mm (back)\n"
+    f"; Wall Z     : {WALL_ORIGIN_Z:.1f} (top) → %.1f mm (bottom)\n"
+    f"; Disp RED   : X={DISPENSERS['RED']['x']}  Y={DISPENSERS['RED']['y']}  Z={DISPENSERS['RED']['z']}\n"
+    f"; Disp YELLOW: X={DISPENSERS['YELLOW']['x']}  Y={DISPENSERS['YELLOW']['y']}  Z={DISPENSERS['YELLOW']['z']}\n"
+    "; ============================================================\n"
+    "\n"
+).encode()
+
+# ── Prusa i3 MK3 start G-code — zero dynamic content, encoded once ────────────
+_START_GCODE = (
+    "M73 P0 R0 Q0 S0        ; progress: 0% (normal + stealth modes)\n"
+    "M201 X1000 Y1000 Z200  ; max accelerations [mm/s^2] — no E (no extruder)\n"
+    "M203 X200 Y200 Z12     ; max feedrates [mm/s]\n"
+    "M204 P1250 T1250       ; print / travel acceleration [mm/s^2]\n"
+    "M205 X8.00 Y8.00 Z0.40 ; jerk limits [mm/s]\n"
+    "G21                    ; units: millimetres\n"
+    "G90                    ; absolute positioning\n"
+    "G28 X Y                ; home X and Y (bottom-left = origin)\n"
+    "G92 Z0                 ; declare current Z as Z=0 (manually parked before run)\n"
+    "M211 S0                ; disable software endstops — allow negative Z\n"
+    "; NOTE: M104/M109/M140/M190 omitted — no hotend/bed on this machine\n"
+    "M83                    ; relative extruder mode (E values are incremental)\n"
+    "G92 E0                 ; reset extruder position\n"
+    "\n"
+).encode()
+
+# ── Prusa i3 MK3 end G-code ───────────────────────────────────────────────────
+# Built per config like the brick template: the final raise runs at a fixed
+# F720, but whether that is a G0 or G1 follows the file's usual rule against
+# the config's approach feed.
+_FINAL_Z = min(SAFE_Z + 10.0, 210.0)   # MK3 max Z is 210 mm
+_END_GCODE_SRC = (
+    "M73 P100 R0 Q100 S0  ; progress: 100%\n"
+    "\n"
+    "; ── All bricks placed ──────────────────────────────────────\n"
+    ";TYPE:Travel\n"
+    f"{{g_final}} Z{_FINAL_Z:.3f} F720 ; raise nozzle clear of wall\n"
+    "; NOTE: M104 S0 / M140 S0 / M107 omitted — no hotend/bed on this machine\n"
+    "M211 S1      ; re-enable software endstops\n"
+    "M84          ; disable steppers\n"
+    "\n"
+)
+
+
+def _end_gcode(cfg: MotionConfig) -> bytes:
+    """The end block for ``cfg`` (see _END_GCODE_SRC)."""
+    return _END_GCODE_SRC.format(
+        g_final="G1" if 720 < cfg.feed_approach else "G0").encode()
+
+
+_END_GCODE = _end_gcode(DEFAULT_CFG)
+
+# ── Per-brick cycle template ──────────────────────────────────────────────────
+# The whole pick / travel / place / retract cycle is one bytes %-format and one
+# write per brick.  Feeds, dwell times, and SAFE_Z never vary, so they are
+# baked in at import; only coordinates, colour, and brick numbering remain.
+_COLOR_NAME_B = tuple(n.encode() for n in COLOR_NAME)
+
+# Feed rates come from a MotionConfig, so the template is built per config
+# (the default one once at import).  {g_*} picks G0 vs G1 by the file's usual
+# rule: G1 whenever the feed is below the approach feed.
+_BRICK_TPL_SRC = (
+    "; ── Brick %4d/%d  [%-6s]  col=%3d  row=%3d  →  X=%.1f  Z=%.1f ──\n"
+    ";    [pick-up  %s]\n"
+    ";TYPE:Travel\n"
+    "{g_trav} X%.3f Y%.3f F{ft} ; move over %s dispenser\n"
+    "G0 Z%.3f F{fa} ; descend to grab height\n"
+    f"G4 P{DISPENSER_DWELL}  ; dwell — let block seat in socket\n"
+    f"{{g_carry}} Z{SAFE_Z:.3f} F{{fc}} ; rise with brick (carry speed)\n"
+    "\n"
+    ";    [travel to brick]\n"
+    ";TYPE:Custom\n"
+    "{g_carry} X%.3f Y%.3f F{fc} ; position over col=%d row=%d (carry speed)\n"
+    "\n"
+    ";    [place]\n"
+    ";TYPE:Travel\n"
+    f"G0 Z%.3f F{{fa}} ; slow approach ({APPROACH_CLEARANCE:.0f} mm above target)\n"
+    "{g_push} Z%.3f F{fp} ; push brick onto studs\n"
+    "G4 P200  ; dwell 200 ms — ensure engagement\n"
+    ";TYPE:Travel\n"
+    f"{{g_trav}} Z{SAFE_Z:.3f} F{{ft}} ; retract to safe height\n"
+    "\n"
+)
+
+
+def _brick_template(cfg: MotionConfig) -> bytes:
+    """Brick-cycle bytes template with the given feed rates baked in."""
+    return _BRICK_TPL_SRC.format(
+        ft=cfg.feed_travel, fc=cfg.feed_carry,
+        fa=cfg.feed_approach, fp=cfg.feed_push,
+        g_trav="G1" if cfg.feed_travel < cfg.feed_approach else "G0",
+        g_carry="G1" if cfg.feed_carry < cfg.feed_approach else "G0",
+        g_push="G1" if cfg.feed_push < cfg.feed_approach else "G0",
+    ).encode()
+
+
+_BRICK_TPL = _brick_template(DEFAULT_CFG)
+
+# ── Layer-change / progress templates ─────────────────────────────────────────
+# The layer height never varies, so it is baked in; only Z and the layer
+# numbering are formatted per row.
+_LAYER_CHANGE_TPL = (
+    ";LAYER_CHANGE\n"
+    ";Z:%.3f\n"
+    f";HEIGHT:{BRICK_HEIGHT:.3f}\n"
+    "; --- Layer %d/%d ---\n"
+).encode()
+
+_M73_TPL = b"M73 P%d R0 Q%d S0  ; progress %d%%\n"
+
+# ── Move-line template ────────────────────────────────────────────────────────
+# The only move emitted outside the brick-cycle template is the initial Z
+# raise.  %-formatting on bytes dispatches straight to the C-level formatter —
+# no per-token f-string evaluation, no join.
+_TPL_MOVE_Z = b"%s Z%.3f F%d ; %s\n"
+
+
+# Bricks formatted per _format_band call on the serial path (bounds memory);
+# jobs at least this many bricks total are fanned out across processes.
+_BAND_BRICKS         = 4096
+_PARALLEL_MIN_BRICKS = 20000
+
+
+def _format_band(cols_arr, rows_arr, colors_arr, brick_tpl, y_of_col,
+                 layer_z_of_row, appr_z_of_row, place_z_of_row,
+                 start: int, total: int, num_rows: int,
+                 prev_row: int, prev_pct: int) -> bytearray:
+    """Format bricks [start, start+len) of the sorted scan into G-code bytes.
+
+    Pure function of its band — safe to run in a worker process.  ``prev_row``
+    and ``prev_pct`` carry the layer/progress state across the band boundary
+    so markers are neither duplicated nor dropped there."""
+    buf = bytearray()
+    current_row = prev_row
+    last_pct    = prev_pct
+
+    # Everything touched per brick is bound to a local first: LOAD_FAST
+    # instead of a dict-backed LOAD_GLOBAL per iteration, and the dispenser
+    # coordinates are pulled out of their dicts once per colour instead of
+    # three dict hashes per brick.
+    layer_tpl = _LAYER_CHANGE_TPL
+    m73_tpl   = _M73_TPL
+    cnames    = _COLOR_NAME_B
+    wall_x    = WALL_X
+    disp_xyz  = tuple((d["x"], d["y"], d["z"]) for d in DISPENSER_LIST)
+
+    # Indexing an ndarray yields numpy scalar objects, which cost far more
+    # than plain ints under bytes-% — convert each band to Python ints once.
+    col_list   = cols_arr.tolist()
+    row_list   = rows_arr.tolist()
+    color_list = colors_arr.tolist()
+
+    for i in range(len(row_list)):
+        idx     = start + i
+        col     = col_list[i]
+        row     = row_list[i]
+        color   = color_list[i]
+        disp_x, disp_y, disp_z = disp_xyz[color]
+        cname   = cnames[color]
+        layer_z = layer_z_of_row[row]
 
         # ── PrusaSlicer layer-change marker (emitted once per LEGO row) ───
         if row != current_row:
             current_row = row
-            emit(
-                ";LAYER_CHANGE",
-                f";Z:{layer_z:.3f}",
-                f";HEIGHT:{BRICK_HEIGHT:.3f}",
-                f"; --- Layer {row + 1}/{num_rows} ---",
-            )
-
-        # M73 progress update (parsed by MK3 LCD and PrusaSlicer viewer)
-        pct = int(round(idx / total * 100))
-        emit(f"M73 P{pct} R0 Q{pct} S0  ; progress {pct}%")
-
-        emit(f"; ── Brick {idx + 1:4d}/{total}  [{color:6s}]  "
-             f"col={col:3d}  row={row:3d}  →  X={target_x:.1f}  Z={layer_z:.1f} ──")
-
-        # 1. Pick up from the correct colour dispenser ----------------------
-        emit(f";    [pick-up  {color}]", ";TYPE:Travel")
-        move(x=disp["x"], y=disp["y"], feed=FEED_TRAVEL,
-             comment=f"move over {color} dispenser")
-        move(z=disp["z"], feed=FEED_APPROACH,
-             comment="descend to grab height")
-        emit(f"G4 P{DISPENSER_DWELL}  ; dwell — let block seat in socket")
-        move(z=SAFE_Z, feed=FEED_CARRY, comment="rise with brick (carry speed)")
-        emit("")
-
-        # 2. Travel to target XY
-        emit(";    [travel to brick]", ";TYPE:Custom")
-        move(x=target_x, y=target_y, e=0.05, feed=FEED_CARRY,
-             comment=f"position over col={col} row={row} (carry speed)")
-        emit("G92 E0   ; reset E after travel mark")
-        emit("")
-
-        # 3. Approach (slow) -----------------------------------------------
-        emit(";    [place]", ";TYPE:Travel")
-        move(z=appr_z, feed=FEED_APPROACH,
-             comment=f"slow approach ({APPROACH_CLEARANCE:.0f} mm above target)")
-
-        # 4. Push onto studs -----------------------------------------------
-        move(z=place_z, feed=FEED_PUSH,
-             comment="push brick onto studs")
-        emit(f"G4 P200  ; dwell 200 ms — ensure engagement")
-
-        # 5. Retract ───────────────────────────────────────────────────────
-        emit(";TYPE:Travel")
-        move(z=SAFE_Z, feed=FEED_TRAVEL, comment="retract to safe height")
-        emit("")
-
-    # ── Prusa i3 MK3 end G-code ───────────────────────────────────────────────
-    final_z = min(SAFE_Z + 10.0, 210.0)   # MK3 max Z is 210 mm
-    emit(
-        "M73 P100 R0 Q100 S0  ; progress: 100%",
-        "",
-        "; ── All bricks placed ──────────────────────────────────────",
-        ";TYPE:Travel",
-    )
-    move(z=final_z, feed=720, comment="raise nozzle clear of wall")
-    emit(
-        "; NOTE: M104 S0 / M140 S0 / M107 omitted — no hotend/bed on this machine",
-        "M211 S1      ; re-enable software endstops",
-        "M84          ; disable steppers",
-        "",
-    )
-
-    # ── PrusaSlicer config block ───────────────────────────────────────────────
-    emit(
-        "; prusaslicer_config = begin",
-        # ── Print settings ────────────────────────────────────────────────────
-        "; avoid_crossing_perimeters = 0",
-        "; avoid_crossing_perimeters_max_detour = 0",
-        "; bottom_fill_pattern = monotonic",
-        "; bottom_solid_layers = 3",
-        "; bottom_solid_min_thickness = 0",
-        "; bridge_acceleration = 0",
-        "; bridge_angle = 0",
-        "; bridge_fan_speed = 100",
-        "; bridge_flow_ratio = 1",
-        "; bridge_speed = 60",
-        "; brim_ears = 0",
-        "; brim_ears_detection_length = 1",
-        "; brim_ears_max_angle = 125",
-        "; brim_separation = 0",
-        "; brim_type = no_brim",
-        "; brim_width = 0",
-        "; clip_multipart_objects = 1",
-        "; colorprint_heights = ",
-        "; complete_objects = 0",
-        "; cooling = 1",
-        "; default_acceleration = 0",
-        "; disable_fan_first_layers = 3",
-        "; dont_support_bridges = 1",
-        "; draft_shield = disabled",
-        "; draft_shield_distance = 10",
-        "; duplicate_distance = 6",
-        "; elefant_foot_compensation = 0",
-        "; elefant_foot_min_width = 0.2",
-        "; end_gcode = M84",
-        "; external_perimeter_extrusion_width = 0.45",
-        "; external_perimeter_speed = 25",
-        "; external_perimeters_first = 0",
-        "; extruder_clearance_height = 20",
-        "; extruder_clearance_radius = 20",
-        "; extrusion_multiplier = 1",
-        f"; extrusion_width = {BRICK_WIDTH:.2f}",
-        "; fan_always_on = 1",
-        "; fan_below_layer_time = 100",
-        "; fill_angle = 45",
-        "; fill_density = 15%",
-        "; fill_pattern = gyroid",
-        "; first_layer_acceleration = 0",
-        "; first_layer_extrusion_width = 0.42",
-        "; first_layer_height = 0.2",
-        "; first_layer_speed = 30",
-        "; gap_fill_enabled = 1",
-        "; gap_fill_speed = 20",
-        "; gcode_comments = 0",
-        "; gcode_flavor = marlin2",
-        "; gcode_label_objects = 1",
-        "; infill_acceleration = 0",
-        "; infill_every_layers = 1",
-        "; infill_extruder = 1",
-        "; infill_extrusion_width = 0.45",
-        "; infill_first = 0",
-        "; infill_only_where_needed = 0",
-        "; infill_overlap = 25%",
-        "; infill_speed = 80",
-        "; interface_shells = 0",
-        "; ironing = 0",
-        "; ironing_flowrate = 15%",
-        "; ironing_spacing = 0.1",
-        "; ironing_speed = 15",
-        "; ironing_type = top",
-        "; layer_gcode = ",
-        f"; layer_height = {BRICK_HEIGHT:.4f}",
-        "; max_print_speed = 200",
-        "; max_volumetric_extrusion_rate_slope_negative = 0",
-        "; max_volumetric_extrusion_rate_slope_positive = 0",
-        "; max_volumetric_speed = 0",
-        "; min_print_speed = 15",
-        "; min_skirt_length = 4",
-        "; notes = ",
-        "; only_retract_when_crossing_perimeters = 0",
-        "; ooze_prevention = 0",
-        "; output_filename_format = {input_filename_base}.gcode",
-        "; overhangs = 1",
-        "; perimeter_acceleration = 0",
-        "; perimeter_extruder = 1",
-        "; perimeter_extrusion_width = 0.45",
-        "; perimeter_speed = 45",
-        "; perimeters = 2",
-        "; post_process = ",
-        "; print_settings_id = ",
-        "; resolution = 0",
-        "; seam_position = aligned",
-        "; skirt_distance = 6",
-        "; skirt_height = 1",
-        "; skirts = 0",
-        "; slowdown_below_layer_time = 5",
-        "; solid_infill_below_area = 70",
-        "; solid_infill_every_layers = 0",
-        "; solid_infill_extruder = 1",
-        "; solid_infill_extrusion_width = 0.45",
-        "; solid_infill_speed = 20",
-        "; spiral_vase = 0",
-        "; standby_temperature_delta = -5",
-        "; support_material = 0",
-        "; support_material_angle = 0",
-        "; support_material_auto = 1",
-        "; support_material_buildplate_only = 0",
-        "; support_material_contact_distance = 0.2",
-        "; support_material_enforce_layers = 0",
-        "; support_material_extruder = 0",
-        "; support_material_extrusion_width = 0.35",
-        "; support_material_interface_contact_loops = 0",
-        "; support_material_interface_extruder = 0",
-        "; support_material_interface_layers = 2",
-        "; support_material_interface_pattern = rectilinear",
-        "; support_material_interface_spacing = 0.2",
-        "; support_material_interface_speed = 100%",
-        "; support_material_pattern = rectilinear",
-        "; support_material_spacing = 2",
-        "; support_material_speed = 50",
-        "; support_material_style = grid",
-        "; support_material_synchronize_layers = 0",
-        "; support_material_threshold = 55",
-        "; support_material_with_sheath = 0",
-        "; support_material_xy_spacing = 60%",
-        "; thick_bridges = 1",
-        "; thin_walls = 1",
-        "; threads = 4",
-        "; toolchange_gcode = ",
-        "; top_fill_pattern = monotonic",
-        "; top_infill_extrusion_width = 0.45",
-        "; top_solid_infill_speed = 15",
-        "; top_solid_layers = 3",
-        "; top_solid_min_thickness = 0",
-        "; travel_speed = 120",
-        "; travel_speed_z = 0",
-        "; use_firmware_retraction = 0",
-        "; use_relative_e_distances = 1",
-        "; use_volumetric_e = 0",
-        "; variable_layer_height = 0",
-        "; wipe_tower = 0",
-        "; wipe_tower_bridging = 10",
-        "; wipe_tower_brim_width = 2",
-        "; wipe_tower_no_sparse_layers = 0",
-        "; wipe_tower_rotation_angle = 0",
-        "; wipe_tower_width = 60",
-        "; wipe_tower_x = 170",
-        "; wipe_tower_y = 140",
-        "; xy_size_compensation = 0",
-        # ── Filament settings ─────────────────────────────────────────────────
-        "; filament_colour = #FF8000",
-        "; filament_cooling_final_speed = 3.4",
-        "; filament_cooling_initial_speed = 2.2",
-        "; filament_cooling_moves = 4",
-        "; filament_cost = 0",
-        "; filament_density = 0",
-        "; filament_diameter = 1.75",
-        "; filament_load_time = 0",
-        "; filament_loading_speed = 28",
-        "; filament_loading_speed_start = 3",
-        "; filament_max_volumetric_speed = 0",
-        "; filament_minimal_purge_on_wipe_tower = 15",
-        "; filament_notes = ",
-        "; filament_settings_id = ",
-        "; filament_soluble = 0",
-        "; filament_spool_weight = 0",
-        "; filament_toolchange_delay = 0",
-        "; filament_type = PLA",
-        "; filament_unload_time = 0",
-        "; filament_unloading_speed = 90",
-        "; filament_unloading_speed_start = 100",
-        "; first_layer_bed_temperature = 0",
-        "; first_layer_temperature = 0",
-        "; max_fan_speed = 100",
-        "; min_fan_speed = 35",
-        "; temperature = 0",
-        # ── Printer settings ──────────────────────────────────────────────────
-        "; before_layer_gcode = ",
-        "; bed_shape = 0x0,250x0,250x210,0x210",
-        "; bed_temperature = 0",
-        "; between_objects_gcode = ",
-        "; cooling_tube_length = 5",
-        "; cooling_tube_retraction = 91.5",
-        "; default_filament_profile = ",
-        "; default_print_profile = ",
-        "; end_filament_gcode = \"; Filament-specific end gcode\"",
-        "; extra_loading_move = -2",
-        "; extruder_colour = #FF8000",
-        "; extruder_offset = 0x0",
-        "; high_current_on_filament_swap = 0",
-        "; host_type = octoprint",
-        "; machine_limits_usage = time_estimate_only",
-        "; machine_max_acceleration_e = 5000,5000",
-        "; machine_max_acceleration_extruding = 1250,1250",
-        "; machine_max_acceleration_retracting = 1500,1500",
-        "; machine_max_acceleration_travel = 1500,1500",
-        "; machine_max_acceleration_x = 1000,1000",
-        "; machine_max_acceleration_y = 1000,1000",
-        "; machine_max_acceleration_z = 200,200",
-        "; machine_max_feedrate_e = 120,120",
-        "; machine_max_feedrate_x = 200,200",
-        "; machine_max_feedrate_y = 200,200",
-        "; machine_max_feedrate_z = 12,12",
-        "; machine_max_jerk_e = 1.5,1.5",
-        "; machine_max_jerk_x = 8,8",
-        "; machine_max_jerk_y = 8,8",
-        "; machine_max_jerk_z = 0.4,0.4",
-        "; machine_min_extruding_rate = 0,0",
-        "; machine_min_travel_rate = 0,0",
-        f"; max_layer_height = {BRICK_HEIGHT:.4f}",
-        "; max_print_height = 210",
-        f"; min_layer_height = {BRICK_HEIGHT:.4f}",
-        "; nozzle_diameter = 0.4",
-        "; parking_pos_retraction = 92",
-        "; printer_model = MK3S",
-        "; printer_notes = ",
-        "; printer_settings_id = ",
-        "; printer_technology = FFF",
-        "; printer_variant = 0.4",
-        "; printer_vendor = Prusa Research",
-        "; remaining_times = 1",
-        "; retract_before_travel = 2",
-        "; retract_before_wipe = 0%",
-        "; retract_layer_change = 0",
-        "; retract_length = 0.8",
-        "; retract_length_toolchange = 4",
-        "; retract_lift = 0.6",
-        "; retract_lift_above = 0",
-        "; retract_lift_below = 209",
-        "; retract_restart_extra = 0",
-        "; retract_restart_extra_toolchange = 0",
-        "; retract_speed = 35",
-        "; silent_mode = 0",
-        "; single_extruder_multi_material = 0",
-        "; start_filament_gcode = \"; Filament gcode\"",
-        "; start_gcode = G28 W",
-        "; wipe = 0",
-        "; wipe_into_infill = 0",
-        "; wipe_into_objects = 0",
-        "; prusaslicer_config = end",
-    )
-
-    return "\n".join(lines)
+            buf += layer_tpl % (layer_z, row + 1, num_rows)
+
+        # M73 progress update (parsed by MK3 LCD and PrusaSlicer viewer) —
+        # integer math, and only emitted when the percentage actually changes
+        pct = (idx * 100) // total
+        if pct != last_pct:
+            last_pct = pct
+            buf += m73_tpl % (pct, pct, pct)
+
+        # Entire pick / travel / place / retract cycle: one format, one append
+        buf += brick_tpl % (idx + 1, total, cname, col, row, wall_x, layer_z,
+                            cname, disp_x, disp_y, cname, disp_z,
+                            wall_x, y_of_col[col], col, row,
+                            appr_z_of_row[row], place_z_of_row[row])
+
+    # Return the bytearray as-is: file.write and pickle both take it
+    # directly, and a bytes() round-trip would copy the whole band.
+    return buf
+
+
+def write_gcode(f, blocks, num_cols: int, num_rows: int,
+                cfg: MotionConfig = DEFAULT_CFG) -> None:
+    """Write the full G-code programme to ``f`` (a binary file-like object).
+
+    Streaming straight into the sink avoids holding hundreds of thousands of
+    line strings in memory plus a giant final join for large walls.  ``cfg``
+    carries the motion feed rates (see trial_run.py for a slow override)."""
+    write = f.write
+    brick_tpl = _BRICK_TPL if cfg is DEFAULT_CFG else _brick_template(cfg)
+    end_gcode = _END_GCODE if cfg is DEFAULT_CFG else _end_gcode(cfg)
+
+    cols, rows, colors = blocks
+
+    # ── Per-column / per-row coordinates, computed once in vector form ────────
+    # (same arithmetic as brick_y / placement_nozzle_z / approach_nozzle_z,
+    #  done for every column and row in four C-level passes)
+    y_arr          = WALL_ORIGIN_Y + np.arange(num_cols) * BRICK_WIDTH
+    layer_z_arr    = WALL_ORIGIN_Z - np.arange(num_rows) * BRICK_HEIGHT
+    place_z_arr    = layer_z_arr - NOZZLE_TO_BRICK_BOTTOM - PUSH_EXTRA
+    appr_z_arr     = place_z_arr + APPROACH_CLEARANCE
+    y_of_col       = y_arr.tolist()          # .tolist() → plain Python floats,
+    layer_z_of_row = layer_z_arr.tolist()    # so the format calls below don't
+    place_z_of_row = place_z_arr.tolist()    # box a NumPy scalar per brick
+    appr_z_of_row  = appr_z_arr.tolist()
+
+    total    = int(colors.size)
+    n_red    = int(np.count_nonzero(colors == RED))
+    n_yellow = total - n_red
+
+    from datetime import datetime, timezone
+    timestamp = datetime.now(timezone.utc).strftime("%Y-%m-%d at %H:%M:%S UTC")
+
+    # ── File header + Prusa i3 MK3 start G-code, coalesced into one write ─────
+    # (everything before the brick bands is a handful of small pieces; joining
+    # them first means one sink call instead of four)
+    write(b"".join((
+        _HEADER_TPL % (timestamp.encode(), num_rows, num_cols, num_rows,
+                       total, n_red, n_yellow,
+                       WALL_ORIGIN_Y + (num_cols - 1) * BRICK_DEPTH,
+                       WALL_ORIGIN_Z - num_rows * BRICK_HEIGHT),
+        _START_GCODE,
+        _TPL_MOVE_Z % (b"G1" if cfg.feed_travel < cfg.feed_approach else b"G0",
+                       SAFE_Z, cfg.feed_travel,
+                       b"raise to safe travel height"),
+        b";TYPE:Travel\n\n",
+    )))
+
+    # Sort: top row first (row 0 = top, builds downward), right to left mirrors
+    # natural X order.  Rows and cols are small bounded ints, so instead of
+    # sorting we stamp a colour grid and read it back row-ascending /
+    # column-descending — np.nonzero on the column-flipped grid yields exactly
+    # that scan order with no comparator at all.
+    grid = np.full((num_rows, num_cols), -1, dtype=np.int8)
+    grid[rows, cols] = colors
+    flipped = grid[:, ::-1]
+    rr, cc  = np.nonzero(flipped >= 0)
+    sorted_cols   = (num_cols - 1 - cc).astype(np.int32)
+    sorted_rows   = rr.astype(np.int32)
+    sorted_colors = flipped[rr, cc]
+
+    # Per-brick formatting is a pure function of each band of the sorted
+    # arrays, so big jobs fan out across processes; band boundary state
+    # (previous row / percentage) is passed in to keep markers exact.
+    ncpu = os.cpu_count() or 1
+    if total >= _PARALLEL_MIN_BRICKS and ncpu > 1:
+        bounds = [(b * total) // ncpu for b in range(ncpu + 1)]
+        with ProcessPoolExecutor() as ex:
+            futures = [
+                ex.submit(_format_band,
+                          sorted_cols[s:e], sorted_rows[s:e],
+                          sorted_colors[s:e], brick_tpl, y_of_col,
+                          layer_z_of_row, appr_z_of_row, place_z_of_row,
+                          s, total, num_rows,
+                          int(sorted_rows[s - 1]) if s else -1,
+                          ((s - 1) * 100 // total) if s else -1)
+                for s, e in zip(bounds, bounds[1:]) if s < e
+            ]
+            for fut in futures:
+                write(fut.result())
+    else:
+        for s in range(0, total, _BAND_BRICKS):
+            e = min(s + _BAND_BRICKS, total)
+            write(_format_band(
+                sorted_cols[s:e], sorted_rows[s:e], sorted_colors[s:e],
+                brick_tpl, y_of_col, layer_z_of_row, appr_z_of_row,
+                place_z_of_row, s, total, num_rows,
+                int(sorted_rows[s - 1]) if s else -1,
+                ((s - 1) * 100 // total) if s else -1))
+
+    # ── Prusa i3 MK3 end G-code + PrusaSlicer config block, one write ─────────
+    write(end_gcode + _prusa_cfg_blob(GENERATE_FULL_PREAMBLE))
+
+
+def generate_gcode(blocks, num_cols: int, num_rows: int,
+                   cfg: MotionConfig = DEFAULT_CFG) -> str:
+    """Render the full G-code programme to one string (thin wrapper around
+    write_gcode for callers that want the text rather than a file)."""
+    buf = io.BytesIO()
+    write_gcode(buf, blocks, num_cols, num_rows, cfg)
+    return buf.getvalue().decode()
 
 
 # ═══════════════════════════════════════════════════════════════════════════════
 #  MAIN
 # ═══════════════════════════════════════════════════════════════════════════════
 
-def main():
-    if len(sys.argv) < 2:
-        print(__doc__)
-        sys.exit("Usage: python nbt_to_gcode.py <structure.nbt> [output.gcode]")
-
-    nbt_path = sys.argv[1]
-    out_path = sys.argv[2] if len(sys.argv) > 2 else Path(nbt_path).stem + ".gcode"
-
-    print("=" * 60)
-    print("  nbt_to_gcode  —  Minecraft Structure → LEGO Wall G-code")
-    print("=" * 60)
+def _gcode_cache_path(nbt_path: str, cfg: MotionConfig):
+    """Path of the cached G-code for this (structure, motion config) pair in
+    ~/.cache/nbt_to_gcode, or None when the structure can't be read.
+
+    The key hashes the raw NBT bytes plus everything else that shapes the
+    output: the motion config, the baked templates, and the PHYSICAL
+    CONFIGURATION constants that flow into the output at runtime (wall and
+    dispenser geometry, the Z math, the colour map, the axis mapping) —
+    editing any of those busts the cache."""
+    try:
+        with open(nbt_path, "rb") as f:
+            digest = hashlib.sha1(f.read())
+    except OSError:
+        return None
+    digest.update(repr(cfg).encode())
+    digest.update(_BRICK_TPL if cfg is DEFAULT_CFG else _brick_template(cfg))
+    digest.update(_HEADER_TPL)
+    digest.update(_LAYER_CHANGE_TPL)
+    digest.update(_START_GCODE)
+    digest.update(_END_GCODE if cfg is DEFAULT_CFG else _end_gcode(cfg))
+    digest.update(_prusa_cfg_blob(GENERATE_FULL_PREAMBLE))
+    # The templates only bake feeds/dwell/SAFE_Z — the rest of the physical
+    # configuration is %-formatted in per run, so it goes into the key as
+    # data.  main() explicitly tells users to edit these before running on
+    # hardware; a stale hit here would ship wrong motion to the machine.
+    digest.update(repr((
+        DISPENSERS, WALL_X, WALL_ORIGIN_Y, WALL_ORIGIN_Z,
+        NOZZLE_TO_BRICK_BOTTOM, PUSH_EXTRA,
+        BRICK_WIDTH, BRICK_DEPTH, BRICK_HEIGHT,
+        SAFE_Z, APPROACH_CLEARANCE,
+        sorted(BLOCK_COLOR_MAP.items()), DEFAULT_LEGO_COLOR, sorted(AIR_BLOCKS),
+        MC_COL_AXIS, MC_ROW_AXIS, MC_DEPTH_AXIS, MC_DEPTH_SLICE,
+    )).encode())
+    return os.path.join(os.path.expanduser("~"), ".cache", "nbt_to_gcode",
+                        digest.hexdigest() + ".gcode")
+
+
+def main(cfg: MotionConfig = DEFAULT_CFG):
+    parser = argparse.ArgumentParser(
+        description="Convert a Minecraft .nbt structure to LEGO wall G-code.")
+    parser.add_argument("nbt", help="input structure file (.nbt)")
+    parser.add_argument("out", nargs="?", default=None,
+                        help="output G-code path (default: <structure>.gcode)")
+    args = parser.parse_args()
+
+    nbt_path = args.nbt
+    out_path = args.out or os.path.splitext(os.path.basename(nbt_path))[0] + ".gcode"
+
+    sys.stdout.write("\n".join((
+        "=" * 60,
+        "  nbt_to_gcode  —  Minecraft Structure → LEGO Wall G-code",
+        "=" * 60,
+    )) + "\n")
 
     blocks, num_cols, num_rows = parse_structure(nbt_path)
 
-    n_red    = sum(1 for _, _, c in blocks if c == "RED")
-    n_yellow = sum(1 for _, _, c in blocks if c == "YELLOW")
+    # Only two colours exist, so one vector compare gives both totals.
+    total    = int(blocks[2].size)
+    n_red    = int(np.count_nonzero(blocks[2] == RED))
+    n_yellow = total - n_red
 
-    print(f"  Structure size : {num_cols} cols × {num_rows} rows")
-    print(f"  Non-air blocks : {len(blocks)}  ({n_red} red, {n_yellow} yellow)")
-    print(f"  Physical wall  : "
-          f"{num_cols * BRICK_WIDTH:.0f} mm wide × "
-          f"{num_rows * BRICK_HEIGHT:.0f} mm tall")
+    sys.stdout.write("\n".join((
+        f"  Structure size : {num_cols} cols × {num_rows} rows",
+        f"  Non-air blocks : {total}  ({n_red} red, {n_yellow} yellow)",
+        f"  Physical wall  : {num_cols * BRICK_WIDTH:.0f} mm wide × "
+        f"{num_rows * BRICK_HEIGHT:.0f} mm tall",
+    )) + "\n")
 
-    if not blocks:
+    if total == 0:
         sys.exit("No non-air blocks found.  Check MC_COL_AXIS, MC_ROW_AXIS, MC_DEPTH_SLICE.")
 
     print_preview(blocks, num_cols, num_rows)
 
-    print(f"\n  Generating G-code …")
-    gcode = generate_gcode(blocks, num_cols, num_rows)
-
-    with open(out_path, "w") as f:
-        f.write(gcode)
-
-    print(f"  Written → {out_path}")
-    print()
-    print("  IMPORTANT: before running on the machine, update the")
-    print("  PHYSICAL CONFIGURATION section at the top of this script")
-    print("  with your actual printer coordinates and nozzle geometry.")
-    print("=" * 60)
+    # Back-to-back runs with identical inputs (the trial_run.py workflow)
+    # short-circuit to a file copy — the key covers everything that shapes
+    # the output, so a hit is guaranteed byte-identical (original timestamp
+    # line included).
+    cache_file = _gcode_cache_path(nbt_path, cfg)
+    if cache_file is not None and os.path.exists(cache_file):
+        print(f"\n  Reusing cached G-code …")
+        shutil.copyfile(cache_file, out_path)
+    else:
+        print(f"\n  Generating G-code …")
+        # Preallocate the output file and stream straight into a memory map —
+        # for multi-MB outputs this skips the extra userspace→page-cache copy
+        # of buffered writes.  ~900 bytes/brick plus header/footer/config is a
+        # safe upper bound; the file is truncated to the real size afterwards.
+        est_size = 900 * total + 65536
+        try:
+            with open(out_path, "w+b") as f:
+                f.truncate(est_size)
+                mm = mmap.mmap(f.fileno(), est_size)
+                write_gcode(mm, blocks, num_cols, num_rows, cfg)
+                final_size = mm.tell()
+                mm.flush()
+                mm.close()
+                f.truncate(final_size)
+        except (OSError, ValueError):
+            # Some filesystems (and mmap on zero-length/special files) refuse
+            # the mapping — fall back to a plain binary file with a 1 MiB
+            # userspace buffer so the many small template writes still
+            # coalesce into a handful of syscalls.
+            with open(out_path, "wb", buffering=1 << 20) as f:
+                write_gcode(f, blocks, num_cols, num_rows, cfg)
+
+        if cache_file is not None:
+            try:
+                os.makedirs(os.path.dirname(cache_file), exist_ok=True)
+                shutil.copyfile(out_path, cache_file)
+            except OSError:
+                pass  # cache dir unwritable — the cache is best-effort
+
+    sys.stdout.write("\n".join((
+        f"  Written → {out_path}",
+        "",
+        "  IMPORTANT: before running on the machine, update the",
+        "  PHYSICAL CONFIGURATION section at the top of this script",
+        "  with your actual printer coordinates and nozzle geometry.",
+        "=" * 60,
+    )) + "\n")
+    sys.stdout.flush()
 
 
 if __name__ == "__main__":
@@ -38,7 +38,7 @@ Pick / place cycle  (per brick)
 
 Dependency
 ----------
-  pip install nbtlib
+  pip install numpy
 
 Usage
 -----
@@ -47,13 +47,25 @@ Usage
   python nbt_to_gcode.py build.nbt wall.gcode    # → wall.gcode
 """
 
+import gzip
+import mmap
+import struct
 import sys
+from collections import Counter
+from functools import lru_cache
 from pathlib import Path
 
 try:
-    import nbtlib
+    import numpy as np
 except ImportError:
-    sys.exit("Missing dependency — install it with:  pip install nbtlib")
+    sys.exit("Missing dependency — install it with:  pip install numpy")
+
+# numba is OPTIONAL — when present the block dedup runs as a compiled
+# kernel; when absent the pure-NumPy path below is used instead.
+try:
+    import numba
+except ImportError:
+    numba = None
 
 
 # ═══════════════════════════════════════════════════════════════════════════════
@@ -138,11 +150,13 @@ MC_DEPTH_SLICE = 0  # int or None
 #  BLOCK FILTER
 # ═══════════════════════════════════════════════════════════════════════════════
 # These Minecraft block names are treated as "empty" — no brick is placed.
-AIR_BLOCKS = {
+# Interned so membership tests on interned palette names hit the identity
+# fast path before any character compare.
+AIR_BLOCKS = frozenset(sys.intern(n) for n in (
     "minecraft:air",
     "minecraft:cave_air",
     "minecraft:void_air",
-}
+))
 
 # ═══════════════════════════════════════════════════════════════════════════════
 #  COLOUR MAPPING  —  Minecraft block name → LEGO colour
@@ -152,6 +166,13 @@ AIR_BLOCKS = {
 
 DEFAULT_LEGO_COLOR = "RED"   # fallback for unmapped blocks
 
+# Internally colours travel as small ints (index into COLOR_NAME) — int
+# compares and list indexing beat string equality and dict probes in the
+# per-brick paths.  BLOCK_COLOR_MAP below stays human-readable.
+RED, YELLOW = 0, 1
+COLOR_NAME  = ("RED", "YELLOW")
+COLOR_CODE  = {"RED": RED, "YELLOW": YELLOW}
+
 BLOCK_COLOR_MAP: dict[str, str] = {
 
     # ── RED ──────────────────────────────────────────────────────────────────
@@ -262,6 +283,177 @@ BLOCK_COLOR_MAP: dict[str, str] = {
 # ═══════════════════════════════════════════════════════════════════════════════
 #  PARSING
 # ═══════════════════════════════════════════════════════════════════════════════
+# Structure-block NBT is read with a minimal streaming parser instead of a
+# full NBT library: only `size`, the palette `Name` strings, and each block's
+# `pos`/`state` are decoded — every other tag payload is skipped by offset
+# arithmetic, never materialized as Python objects.
+
+# NBT tag ids (big-endian wire format)
+(_TAG_END, _TAG_BYTE, _TAG_SHORT, _TAG_INT, _TAG_LONG, _TAG_FLOAT, _TAG_DOUBLE,
+ _TAG_BYTE_ARRAY, _TAG_STRING, _TAG_LIST, _TAG_COMPOUND, _TAG_INT_ARRAY,
+ _TAG_LONG_ARRAY) = range(13)
+
+_TAG_FIXED_SIZE = {_TAG_BYTE: 1, _TAG_SHORT: 2, _TAG_INT: 4, _TAG_FLOAT: 4,
+                   _TAG_LONG: 8, _TAG_DOUBLE: 8}
+
+
+def _skip_payload(data, off: int, tag: int) -> int:
+    """Return the offset just past the payload of `tag` starting at `off`."""
+    fixed = _TAG_FIXED_SIZE.get(tag)
+    if fixed is not None:
+        return off + fixed
+    if tag == _TAG_STRING:
+        return off + 2 + int.from_bytes(data[off:off + 2], "big")
+    if tag == _TAG_BYTE_ARRAY:
+        return off + 4 + int.from_bytes(data[off:off + 4], "big", signed=True)
+    if tag == _TAG_INT_ARRAY:
+        return off + 4 + 4 * int.from_bytes(data[off:off + 4], "big", signed=True)
+    if tag == _TAG_LONG_ARRAY:
+        return off + 4 + 8 * int.from_bytes(data[off:off + 4], "big", signed=True)
+    if tag == _TAG_LIST:
+        etag = data[off]
+        n    = int.from_bytes(data[off + 1:off + 5], "big", signed=True)
+        off += 5
+        fixed = _TAG_FIXED_SIZE.get(etag)
+        if fixed is not None:
+            return off + fixed * n
+        for _ in range(n):
+            off = _skip_payload(data, off, etag)
+        return off
+    if tag == _TAG_COMPOUND:
+        while True:
+            t = data[off]
+            off += 1
+            if t == _TAG_END:
+                return off
+            off += 2 + int.from_bytes(data[off:off + 2], "big")
+            off = _skip_payload(data, off, t)
+    raise ValueError(f"unsupported NBT tag id {tag}")
+
+
+def _read_list_header(data, off: int):
+    """Read a TAG_List header → (offset past header, element tag, count)."""
+    etag = data[off]
+    n    = int.from_bytes(data[off + 1:off + 5], "big", signed=True)
+    return off + 5, etag, n
+
+
+def _read_palette(data, off: int):
+    """Read the palette list; return (new offset, list of block-name strings)."""
+    off, etag, n = _read_list_header(data, off)
+    names = [""] * n
+    for i in range(n):
+        # each entry: compound with a Name string and optional Properties
+        while True:
+            t = data[off]
+            off += 1
+            if t == _TAG_END:
+                break
+            nlen = int.from_bytes(data[off:off + 2], "big")
+            name = bytes(data[off + 2:off + 2 + nlen])
+            off += 2 + nlen
+            if t == _TAG_STRING and name == b"Name":
+                slen = int.from_bytes(data[off:off + 2], "big")
+                names[i] = sys.intern(str(data[off + 2:off + 2 + slen], "utf-8"))
+                off += 2 + slen
+            else:
+                off = _skip_payload(data, off, t)
+    return off, names
+
+
+def _read_blocks(data, off: int):
+    """Read the blocks list; return (new offset, (N, 4) int32 array of x,y,z,state)."""
+    off, etag, n = _read_list_header(data, off)
+    arr = np.empty((n, 4), dtype=np.int32)
+    unpack_pos = struct.Struct(">3i").unpack_from
+    for i in range(n):
+        state = 0
+        pos   = (0, 0, 0)
+        while True:
+            t = data[off]
+            off += 1
+            if t == _TAG_END:
+                break
+            nlen = int.from_bytes(data[off:off + 2], "big")
+            name = bytes(data[off + 2:off + 2 + nlen])
+            off += 2 + nlen
+            if t == _TAG_LIST and name == b"pos":
+                off += 5                      # element tag (Int) + count (3)
+                pos  = unpack_pos(data, off)
+                off += 12
+            elif t == _TAG_INT and name == b"state":
+                state = int.from_bytes(data[off:off + 4], "big", signed=True)
+                off  += 4
+            else:
+                off = _skip_payload(data, off, t)
+        arr[i, 0] = pos[0]
+        arr[i, 1] = pos[1]
+        arr[i, 2] = pos[2]
+        arr[i, 3] = state
+    return off, arr
+
+
+def _read_structure(nbt_path: str):
+    """Stream-parse a structure NBT file → (size, palette_names, (N,4) blocks)."""
+    with open(nbt_path, "rb") as f:
+        # mmap the compressed file so gzip.decompress reads straight out of the
+        # page cache — no intermediate file-object buffering or double read.
+        with mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ) as raw:
+            if raw[:2] == b"\x1f\x8b":       # gzip magic — structure files default
+                data = memoryview(gzip.decompress(raw))
+            else:                            # rare: already-uncompressed NBT
+                data = memoryview(bytes(raw))
+
+    off = 0
+    if data[off] != _TAG_COMPOUND:
+        raise ValueError(f"{nbt_path}: not an NBT compound root")
+    off += 1
+    off += 2 + int.from_bytes(data[off:off + 2], "big")   # root name
+
+    size = palette_names = blocks = None
+    while True:
+        t = data[off]
+        off += 1
+        if t == _TAG_END:
+            break
+        nlen = int.from_bytes(data[off:off + 2], "big")
+        name = bytes(data[off + 2:off + 2 + nlen])
+        off += 2 + nlen
+        if t == _TAG_LIST and name == b"size":
+            off, etag, n = _read_list_header(data, off)
+            size = list(struct.unpack_from(f">{n}i", data, off))
+            off += 4 * n
+        elif t == _TAG_LIST and name == b"palette":
+            off, palette_names = _read_palette(data, off)
+        elif t == _TAG_LIST and name == b"blocks":
+            off, blocks = _read_blocks(data, off)
+        else:
+            off = _skip_payload(data, off, t)
+
+    if size is None or palette_names is None or blocks is None:
+        raise ValueError(f"{nbt_path}: missing size/palette/blocks — not a structure file?")
+    return size, palette_names, blocks
+
+
+if numba is not None:
+    @numba.njit(cache=True)
+    def _dedup_first(cols, rows, states, num_cols, num_rows):
+        """First-occurrence dedup on (col, row) via a flat presence bitmap."""
+        seen  = np.zeros(num_cols * num_rows, np.uint8)
+        out_c = np.empty(cols.shape[0], np.int32)
+        out_r = np.empty(cols.shape[0], np.int32)
+        out_s = np.empty(cols.shape[0], np.int32)
+        n = 0
+        for i in range(cols.shape[0]):
+            k = cols[i] * num_rows + rows[i]
+            if seen[k] == 0:
+                seen[k] = 1
+                out_c[n] = cols[i]
+                out_r[n] = rows[i]
+                out_s[n] = states[i]
+                n += 1
+        return out_c[:n], out_r[:n], out_s[:n]
+
 
 def parse_structure(nbt_path: str):
     """
@@ -269,20 +461,13 @@ def parse_structure(nbt_path: str):
 
     Returns
     -------
-    blocks   : list of (col, row, color) tuples for every non-air block
-               color is "RED" or "YELLOW" (resolved via BLOCK_COLOR_MAP)
+    blocks   : (cols, rows, colors) int32 SoA arrays, one entry per non-air
+               block; colors hold RED (0) / YELLOW (1) via BLOCK_COLOR_MAP
     num_cols : total column count (width)
     num_rows : total row count (height)
     """
     print(f"  Loading NBT: {nbt_path}")
-    nbt = nbtlib.load(nbt_path)
-
-    # nbtlib exposes the root compound directly; handle both wrapped and raw forms
-    root = nbt.get("", nbt)  # some files wrap root under an empty-string key
-
-    size       = root["size"]
-    palette    = root["palette"]
-    raw_blocks = root["blocks"]
+    size, palette_names, arr = _read_structure(nbt_path)
 
     num_cols = int(size[MC_COL_AXIS])
     num_rows = int(size[MC_ROW_AXIS])
@@ -293,32 +478,55 @@ def parse_structure(nbt_path: str):
     elif depth > 1 and MC_DEPTH_SLICE is None:
         print(f"  NOTE: structure is {depth} blocks deep; merging all depth slices.")
 
-    unmapped: set[str] = set()
-    seen: dict[tuple, str] = {}   # (col, row) → color
-    blocks = []
-
-    for blk in raw_blocks:
-        pos       = blk["pos"]
-        state_idx = int(blk["state"])
-        name      = str(palette[state_idx]["Name"])
-
-        if name in AIR_BLOCKS:
-            continue
-
-        depth_val = int(pos[MC_DEPTH_AXIS])
-        if MC_DEPTH_SLICE is not None and depth_val != MC_DEPTH_SLICE:
-            continue
-
-        col = int(pos[MC_COL_AXIS])
-        row = int(pos[MC_ROW_AXIS])
-
-        if name not in BLOCK_COLOR_MAP:
-            unmapped.add(name)
-        color = BLOCK_COLOR_MAP.get(name, DEFAULT_LEGO_COLOR)
-
-        if (col, row) not in seen:
-            seen[(col, row)] = color
-            blocks.append((col, row, color))
+    # Resolve the palette ONCE — it has a handful of entries reused by
+    # thousands of blocks, so per-block name/colour lookups are pure waste.
+    palette_color  = tuple(COLOR_CODE[BLOCK_COLOR_MAP.get(n, DEFAULT_LEGO_COLOR)]
+                           for n in palette_names)
+    palette_is_air = np.array([n in AIR_BLOCKS for n in palette_names],
+                              dtype=bool)
+
+    # The parser already delivers SoA int32 columns; the air and depth
+    # filters run as C-level masks over them.
+    cols   = arr[:, MC_COL_AXIS]
+    rows   = arr[:, MC_ROW_AXIS]
+    depths = arr[:, MC_DEPTH_AXIS]
+    states = arr[:, 3]
+
+    mask = ~palette_is_air[states]
+    if MC_DEPTH_SLICE is not None:
+        mask &= depths == MC_DEPTH_SLICE
+    cols, rows, states = cols[mask], rows[mask], states[mask]
+
+    # A malformed pos outside the declared size would index past the dedup
+    # bitmap (unchecked in numba's nopython mode) — drop such blocks up
+    # front, mirroring the bounds check print_preview already does.
+    in_bounds = ((cols >= 0) & (cols < num_cols)
+                 & (rows >= 0) & (rows < num_rows))
+    if not in_bounds.all():
+        n_oob = int(in_bounds.size) - int(np.count_nonzero(in_bounds))
+        print(f"  NOTE: {n_oob} block(s) outside the declared "
+              f"{num_cols}×{num_rows} structure size — ignored.")
+        cols, rows, states = cols[in_bounds], rows[in_bounds], states[in_bounds]
+
+    used_names = (palette_names[s] for s in np.unique(states).tolist())
+    unmapped   = {n for n in used_names if n not in BLOCK_COLOR_MAP}
+
+    # Dedup on a packed scalar key instead of a (col, row) tuple-keyed dict —
+    # no per-block tuple allocation or hashing.  With numba installed the
+    # bitmap kernel runs compiled; otherwise np.unique's return_index gives
+    # the FIRST occurrence of each key, matching the old dict insertion
+    # semantics, and re-sorting the indices restores input order.
+    if numba is not None:
+        cols, rows, states = _dedup_first(cols, rows, states,
+                                          num_cols, num_rows)
+    else:
+        key = cols.astype(np.int64) * num_rows + rows
+        _, first = np.unique(key, return_index=True)
+        first.sort()
+        cols, rows, states = cols[first], rows[first], states[first]
+
+    colors = np.array(palette_color, dtype=np.int32)[states]
+    blocks = (cols, rows, colors)
 
     if unmapped:
         print(f"  NOTE: {len(unmapped)} unmapped block type(s) → defaulting to "
@@ -336,16 +544,19 @@ def parse_structure(nbt_path: str):
 def print_preview(blocks, num_cols, num_rows):
     """Print a colour-coded ASCII preview of the parsed wall (row 0 at bottom).
     R = red brick, Y = yellow brick, . = air."""
-    COLOR_CHAR = {"RED": "R", "YELLOW": "Y"}
-    grid = [['.' for _ in range(num_cols)] for _ in range(num_rows)]
-    for col, row, color in blocks:
+    # One flat byte per cell — no list-of-lists of 1-char strings, and each
+    # printed row is a straight slice + ASCII decode.
+    grid = bytearray(b"." * (num_rows * num_cols))
+    cols, rows, colors = blocks
+    for col, row, color in zip(cols.tolist(), rows.tolist(), colors.tolist()):
         if 0 <= row < num_rows and 0 <= col < num_cols:
-            grid[row][col] = COLOR_CHAR.get(color, "?")
+            grid[row * num_cols + col] = 0x52 if color == RED else 0x59  # R / Y
 
     preview_cols = min(num_cols, 80)
     print(f"\n  Preview (row 0 = bottom,  R = red  Y = yellow  . = air):")
     for row in range(num_rows - 1, -1, -1):
-        line = ''.join(grid[row][:preview_cols])
+        base = row * num_cols
+        line = grid[base:base + preview_cols].decode("ascii")
         if num_cols > 80:
             line += '…'
         print(f"  {row:3d}│{line}")
@@ -358,6 +569,7 @@ def print_preview(blocks, num_cols, num_rows):
 #  Z MATH
 # ═══════════════════════════════════════════════════════════════════════════════
 
+@lru_cache(maxsize=512)
 def placement_nozzle_z(row: int) -> float:
     """
     Nozzle Z (mm) at the moment the brick is pushed onto studs.
@@ -372,6 +584,7 @@ def placement_nozzle_z(row: int) -> float:
     return brick_bottom_target + NOZZLE_TO_BRICK_BOTTOM - PUSH_EXTRA
 
 
+@lru_cache(maxsize=512)
 def approach_nozzle_z(row: int) -> float:
     """Nozzle Z to slow down at before the final push."""
     return placement_nozzle_z(row) + APPROACH_CLEARANCE
@@ -381,11 +594,21 @@ def approach_nozzle_z(row: int) -> float:
 #  G-CODE GENERATION
 # ═══════════════════════════════════════════════════════════════════════════════
 
-def generate_gcode(blocks, num_cols: int, num_rows: int) -> str:
-    lines = []
+def write_gcode(blocks, num_cols: int, num_rows: int, fp, counts=None) -> None:
+    """Stream G-code for `blocks` straight to the open text file `fp`.
+
+    Lines go to the (buffered) file handle as they are produced — no
+    intermediate list-of-lines or giant joined string is ever built.
+    `counts` is an optional colour→count Counter (computed by the caller);
+    omitted, it is derived here in one pass.
+    """
+    # Bind the bound method once — the hot loop then uses a local instead
+    # of re-resolving the attribute on every call.
+    write = fp.write
 
     def emit(*args):
-        lines.extend(args)
+        write("\n".join(args))
+        write("\n")
 
     def move(x=None, y=None, z=None, e=None, feed=None, comment=""):
         # Force G1 when E is present (viewer requires G1 to render extrusion paths)
@@ -397,11 +620,15 @@ def generate_gcode(blocks, num_cols: int, num_rows: int) -> str:
         if e is not None: parts.append(f"E{e:.4f}")
         if feed is not None: parts.append(f"F{int(feed)}")
         if comment: parts.append(f"; {comment}")
-        lines.append(" ".join(parts))
+        write(" ".join(parts))
+        write("\n")
 
-    n_red    = sum(1 for _, _, c in blocks if c == "RED")
-    n_yellow = sum(1 for _, _, c in blocks if c == "YELLOW")
-    total    = len(blocks)
+    cols, rows, colors = blocks
+    if counts is None:
+        counts = Counter(colors.tolist())
+    n_red    = counts[RED]
+    n_yellow = counts[YELLOW]
+    total    = cols.size
 
     from datetime import datetime, timezone
     timestamp = datetime.now(timezone.utc).strftime("%Y-%m-%d at %H:%M:%S UTC")
@@ -449,18 +676,51 @@ def generate_gcode(blocks, num_cols: int, num_rows: int) -> str:
     move(z=SAFE_Z, feed=FEED_TRAVEL, comment="raise to safe travel height")
     emit(";TYPE:Travel", "")
 
-    # Sort: bottom row first, left to right within each row
-    sorted_blocks = sorted(blocks, key=lambda b: (b[1], b[0]))
+    # Sort: bottom row first; within a row, batch by colour (then left to
+    # right) so the head works through same-colour runs instead of
+    # ping-ponging between dispensers on every colour flip — this saves
+    # machine travel time, not Python time.  np.lexsort keys run last-first,
+    # all in C — no per-comparison Python key callable.
+    order = np.lexsort((cols, colors, rows))
+    sorted_blocks = zip(cols[order].tolist(), rows[order].tolist(),
+                        colors[order].tolist())
+
+    # Only num_cols + num_rows distinct coordinate values serve every brick —
+    # compute them all up front so the loop body is pure list indexing.
+    col_to_x       = [WALL_ORIGIN_X + c * BRICK_WIDTH for c in range(num_cols)]
+    row_to_place_z = [placement_nozzle_z(r) for r in range(num_rows)]
+    row_to_appr_z  = [approach_nozzle_z(r) for r in range(num_rows)]
+    row_to_layer_z = [WALL_ORIGIN_Z + r * BRICK_HEIGHT for r in range(num_rows)]
+
+    # Pre-format every coordinate token and the whole per-colour pick-up
+    # block once — the loop below never runs the float formatter again.
+    x_tokens       = [f"X{x:.3f}" for x in col_to_x]
+    y_token        = f"Y{WALL_ORIGIN_Y:.3f}"
+    appr_z_tokens  = [f"Z{z:.3f}" for z in row_to_appr_z]
+    place_z_tokens = [f"Z{z:.3f}" for z in row_to_place_z]
+    safe_z_token   = f"Z{SAFE_Z:.3f}"
+    retract_line   = f"G0 {safe_z_token} F{FEED_TRAVEL} ; retract to safe height\n"
+    carry_suffix   = f" E0.0500 F{FEED_CARRY}"
+    appr_suffix    = (f" F{FEED_APPROACH} ; slow approach "
+                      f"({APPROACH_CLEARANCE:.0f} mm above target)\n")
+    push_suffix    = f" F{FEED_PUSH} ; push brick onto studs\n"
+    pickup_block   = [
+        (f";    [pick-up  {name}]\n"
+         ";TYPE:Travel\n"
+         f"G0 X{d['x']:.3f} Y{d['y']:.3f} F{FEED_TRAVEL}"
+         f" ; move over {name} dispenser\n"
+         f"G0 Z{d['z']:.3f} F{FEED_APPROACH} ; descend to grab height\n"
+         f"G4 P{DISPENSER_DWELL}  ; dwell — let block seat in socket\n"
+         f"G0 {safe_z_token} F{FEED_CARRY} ; rise with brick (carry speed)\n"
+         "\n")
+        for name, d in ((n, DISPENSERS[n]) for n in COLOR_NAME)
+    ]
 
     current_row = -1
 
     for idx, (col, row, color) in enumerate(sorted_blocks):
-        target_x  = WALL_ORIGIN_X + col * BRICK_WIDTH
-        target_y  = WALL_ORIGIN_Y
-        place_z   = placement_nozzle_z(row)
-        appr_z    = approach_nozzle_z(row)
-        disp      = DISPENSERS[color]
-        layer_z   = WALL_ORIGIN_Z + row * BRICK_HEIGHT
+        target_x  = col_to_x[col]
+        layer_z   = row_to_layer_z[row]
 
         # ── PrusaSlicer layer-change marker (emitted once per LEGO row) ───
         if row != current_row:
@@ -472,44 +732,29 @@ def generate_gcode(blocks, num_cols: int, num_rows: int) -> str:
                 f"; --- Layer {row + 1}/{num_rows} ---",
             )
 
-        # M73 progress update (parsed by MK3 LCD and PrusaSlicer viewer)
+        # M73 progress + banner + the full pick/travel/place/retract cycle —
+        # one f-string, one write per brick.
         pct = int(round(idx / total * 100))
-        emit(f"M73 P{pct} R0 Q{pct} S0  ; progress {pct}%")
-
-        emit(f"; ── Brick {idx + 1:4d}/{total}  [{color:6s}]  "
-             f"col={col:3d}  row={row:3d}  →  X={target_x:.1f}  Z={layer_z:.1f} ──")
-
-        # 1. Pick up from the correct colour dispenser ----------------------
-        emit(f";    [pick-up  {color}]", ";TYPE:Travel")
-        move(x=disp["x"], y=disp["y"], feed=FEED_TRAVEL,
-             comment=f"move over {color} dispenser")
-        move(z=disp["z"], feed=FEED_APPROACH,
-             comment="descend to grab height")
-        emit(f"G4 P{DISPENSER_DWELL}  ; dwell — let block seat in socket")
-        move(z=SAFE_Z, feed=FEED_CARRY, comment="rise with brick (carry speed)")
-        emit("")
-
-        # 2. Travel to target XY
-        emit(";    [travel to brick]", ";TYPE:Custom")
-        move(x=target_x, y=target_y, e=0.05, feed=FEED_CARRY,
-             comment=f"position over col={col} row={row} (carry speed)")
-        emit("G92 E0   ; reset E after travel mark")
-        emit("")
-
-        # 3. Approach (slow) -----------------------------------------------
-        emit(";    [place]", ";TYPE:Travel")
-        move(z=appr_z, feed=FEED_APPROACH,
-             comment=f"slow approach ({APPROACH_CLEARANCE:.0f} mm above target)")
-
-        # 4. Push onto studs -----------------------------------------------
-        move(z=place_z, feed=FEED_PUSH,
-             comment="push brick onto studs")
-        emit(f"G4 P200  ; dwell 200 ms — ensure engagement")
-
-        # 5. Retract ───────────────────────────────────────────────────────
-        emit(";TYPE:Travel")
-        move(z=SAFE_Z, feed=FEED_TRAVEL, comment="retract to safe height")
-        emit("")
+        write(
+            f"M73 P{pct} R0 Q{pct} S0  ; progress {pct}%\n"
+            f"; ── Brick {idx + 1:4d}/{total}  [{COLOR_NAME[color]:6s}]  "
+            f"col={col:3d}  row={row:3d}  →  X={target_x:.1f}  Z={layer_z:.1f} ──\n"
+            + pickup_block[color] +
+            ";    [travel to brick]\n"
+            ";TYPE:Custom\n"
+            f"G1 {x_tokens[col]} {y_token}{carry_suffix}"
+            f" ; position over col={col} row={row} (carry speed)\n"
+            "G92 E0   ; reset E after travel mark\n"
+            "\n"
+            ";    [place]\n"
+            ";TYPE:Travel\n"
+            f"G0 {appr_z_tokens[row]}{appr_suffix}"
+            f"G1 {place_z_tokens[row]}{push_suffix}"
+            "G4 P200  ; dwell 200 ms — ensure engagement\n"
+            ";TYPE:Travel\n"
+            + retract_line +
+            "\n"
+        )
 
     # ── Prusa i3 MK3 end G-code ───────────────────────────────────────────────
     final_z = min(SAFE_Z + 10.0, 210.0)   # MK3 max Z is 210 mm
@@ -766,8 +1011,6 @@ def generate_gcode(blocks, num_cols: int, num_rows: int) -> str:
         "; prusaslicer_config = end",
     )
 
-    return "\n".join(lines)
-
 
 # ═══════════════════════════════════════════════════════════════════════════════
 #  MAIN
@@ -787,25 +1030,24 @@ def main():
 
     blocks, num_cols, num_rows = parse_structure(nbt_path)
 
-    n_red    = sum(1 for _, _, c in blocks if c == "RED")
-    n_yellow = sum(1 for _, _, c in blocks if c == "YELLOW")
+    counts   = Counter(blocks[2].tolist())
+    n_red    = counts[RED]
+    n_yellow = counts[YELLOW]
 
     print(f"  Structure size : {num_cols} cols × {num_rows} rows")
-    print(f"  Non-air blocks : {len(blocks)}  ({n_red} red, {n_yellow} yellow)")
+    print(f"  Non-air blocks : {blocks[0].size}  ({n_red} red, {n_yellow} yellow)")
     print(f"  Physical wall  : "
           f"{num_cols * BRICK_WIDTH:.0f} mm wide × "
           f"{num_rows * BRICK_HEIGHT:.0f} mm tall")
 
-    if not blocks:
+    if blocks[0].size == 0:
         sys.exit("No non-air blocks found.  Check MC_COL_AXIS, MC_ROW_AXIS, MC_DEPTH_SLICE.")
 
     print_preview(blocks, num_cols, num_rows)
 
     print(f"\n  Generating G-code …")
-    gcode = generate_gcode(blocks, num_cols, num_rows)
-
-    with open(out_path, "w") as f:
-        f.write(gcode)
+    with open(out_path, "w", buffering=1 << 20) as f:
+        write_gcode(blocks, num_cols, num_rows, f, counts)
 
     print(f"  Written → {out_path}")
     print()
@@ -13,11 +13,13 @@ safely and stop the machine if something looks wrong.
 
 import nbt_to_gcode as ng
 
-# ── Override motion speeds for trial run ──────────────────────────────────────
-ng.FEED_TRAVEL   =  500   # mm/min   (normal: 6000)  empty travel
-ng.FEED_CARRY    =  300   # mm/min   (normal: 2000)  travel while holding brick
-ng.FEED_APPROACH =  100   # mm/min   (normal:  800)  slow descent above studs
-ng.FEED_PUSH     =   30   # mm/min   (normal:  150)  final push onto studs
+# ── Trial motion speeds ───────────────────────────────────────────────────────
+TRIAL_CFG = ng.MotionConfig(
+    feed_travel   = 500,   # mm/min   (normal: 9000)  empty travel
+    feed_carry    = 300,   # mm/min   (normal: 4000)  travel while holding brick
+    feed_approach = 100,   # mm/min   (normal: 1500)  slow descent above studs
+    feed_push     =  30,   # mm/min   (normal:  300)  final push onto studs
+)
 
 if __name__ == "__main__":
-    ng.main()
+    ng.main(cfg=TRIAL_CFG)